@@ -0,0 +1,139 @@
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+
+def utc_now():
+    # Naive UTC, matching what SQLite's CURRENT_TIMESTAMP stores
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class RollingAggregate:
+    def __init__(self, sum_fields, max_fields, dimensions, quantile_fields=(), window=timedelta(hours=1)):
+        self.sum_fields = tuple(sum_fields)
+        self.max_fields = tuple(max_fields)
+        self.dimensions = tuple(dimensions)
+        self.quantile_fields = tuple(quantile_fields)
+        self.window = window
+        self.ready = False
+        self._lock = threading.Lock()
+        # Updates seen while a rebuild reads the database, applied again on top of what it read
+        self._replay = None
+        self._reset()
+
+    def _reset(self):
+        # Latest record per server_uid, oldest first so expiry only looks at the front
+        self._entries = OrderedDict()
+        self._sums = {field: 0 for field in self.sum_fields}
+        self._values = {field: Counter() for field in self.max_fields}
+        self._maxima = {field: None for field in self.max_fields}
+        self._histograms = {dimension: Counter() for dimension in self.dimensions}
+        # Servers per value, read back as exact quantiles
+        self._quantile_values = {field: Counter() for field in self.quantile_fields}
+
+    def _add(self, record):
+        for field in self.sum_fields:
+            self._sums[field] += record[field]
+        for field in self.max_fields:
+            value = record[field]
+            self._values[field][value] += 1
+            if self._maxima[field] is None or value > self._maxima[field]:
+                self._maxima[field] = value
+        for dimension in self.dimensions:
+            self._histograms[dimension][record[dimension]] += 1
+        for field in self.quantile_fields:
+            if record[field] is not None:
+                self._quantile_values[field][record[field]] += 1
+
+    def _remove(self, record):
+        for field in self.sum_fields:
+            self._sums[field] -= record[field]
+        for field in self.max_fields:
+            value = record[field]
+            values = self._values[field]
+            values[value] -= 1
+            if not values[value]:
+                del values[value]
+                # Only losing the last copy of the maximum needs a rescan
+                if value == self._maxima[field]:
+                    self._maxima[field] = max(values) if values else None
+        for dimension in self.dimensions:
+            histogram = self._histograms[dimension]
+            histogram[record[dimension]] -= 1
+            if not histogram[record[dimension]]:
+                del histogram[record[dimension]]
+        for field in self.quantile_fields:
+            if record[field] is None:
+                continue
+            values = self._quantile_values[field]
+            values[record[field]] -= 1
+            if not values[record[field]]:
+                del values[record[field]]
+
+    def _expire(self, now):
+        cutoff = now - self.window
+        while self._entries:
+            server_uid, (timestamp, record) = next(iter(self._entries.items()))
+            if timestamp >= cutoff:
+                break
+            self._entries.popitem(last=False)
+            self._remove(record)
+
+    def _insert(self, server_uid, timestamp, record):
+        previous = self._entries.pop(server_uid, None)
+        if previous is not None:
+            self._remove(previous[1])
+        self._entries[server_uid] = (timestamp, record)
+        self._add(record)
+
+    def update(self, server_uid, record, timestamp=None):
+        timestamp = timestamp or utc_now()
+        record = {key: record[key] for key in self.sum_fields + self.max_fields + self.dimensions + self.quantile_fields}
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((server_uid, timestamp, record))
+            self._insert(server_uid, timestamp, record)
+            self._expire(timestamp)
+
+    def begin_rebuild(self):
+        # Call before reading the rows passed to rebuild, so a write committed in between isn't lost
+        with self._lock:
+            self._replay = []
+
+    def cancel_rebuild(self):
+        with self._lock:
+            self._replay = None
+
+    def rebuild(self, rows):
+        # rows are (server_uid, timestamp, record) as loaded from the stats table
+        rows = sorted(rows, key=lambda row: row[1])
+        with self._lock:
+            self._reset()
+            for server_uid, timestamp, record in rows + (self._replay or []):
+                self._insert(server_uid, timestamp, record)
+            self._replay = None
+            self._expire(utc_now())
+            self.ready = True
+
+    def totals(self):
+        # snapshot without the distributions, cheap enough to call on every write
+        with self._lock:
+            self._expire(utc_now())
+            return {'count': len(self._entries), 'sums': dict(self._sums), 'maxima': dict(self._maxima)}
+
+    def snapshot(self, now=None):
+        with self._lock:
+            self._expire(now or utc_now())
+            return {
+                'count': len(self._entries),
+                'sums': dict(self._sums),
+                'maxima': dict(self._maxima),
+                'distributions': {
+                    dimension: sorted(histogram.items())
+                    for dimension, histogram in self._histograms.items()
+                }
+            }
+
+    def quantile_counts(self):
+        # {field: [(value, servers)]} sorted by value
+        with self._lock:
+            self._expire(utc_now())
+            return {field: sorted(values.items()) for field, values in self._quantile_values.items()}
@@ -1,35 +1,203 @@
-from flask import Blueprint, request, jsonify
-from app.stats_manager import StatsManager
+import time
+from flask import Blueprint, Response, g, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+from app.stats_manager import HandlersFailedError, StatsManager
+from app.ingest_buffer import BufferFullError
+from app.response_cache import stats_cache
+from app.timeseries import parse_window
+from utils import json_codec
 from utils.auth import require_auth
+from utils.metrics import registry
+from utils.query_profiler import query_profiler
+import config
 
 api_bp = Blueprint('api', __name__)
 
+request_count = registry.counter(
+    'stats_http_requests_total', 'Requests answered, by route, handler and status', ('route', 'handler', 'status')
+)
+request_seconds = registry.histogram(
+    'stats_http_request_duration_seconds', 'Time to answer a request, by route and handler', ('route', 'handler')
+)
+rejections = registry.counter(
+    'stats_submissions_rejected_total', 'Submissions refused before being stored, by reason', ('route', 'reason')
+)
+
+@api_bp.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@api_bp.after_request
+def record_request(response):
+    if config.METRICS_ENABLED and request.url_rule is not None:
+        # Views name the handler once they know it is a valid one, so label values stay bounded
+        route, handler = request.url_rule.rule, g.get('metrics_handler', '-')
+        request_seconds.observe(time.perf_counter() - g.request_started, route, handler)
+        request_count.inc(route, handler, str(response.status_code))
+    return response
+
+def reject(reason, message, status=400):
+    rejections.inc(request.url_rule.rule, reason)
+    return jsonify({'error': message}), status
+
+# Bodies over MAX_CONTENT_LENGTH are refused by Flask as they are read
+@api_bp.errorhandler(RequestEntityTooLarge)
+def payload_too_large(error):
+    return reject('too_large', 'Payload Too Large', 413)
+
+def buffer_full_response(error):
+    response, status = reject('buffer_full', 'Service Unavailable: Too many pending submissions', 503)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, status
+
+def etag_response(body, etag):
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
 @api_bp.route('/submit', methods=['POST'])
 @require_auth
 def submit_data():
     if not request.is_json:
-        return jsonify({'error': 'Bad Request: Expected JSON'}), 400
+        return reject('not_json', 'Bad Request: Expected JSON')
+    # A heartbeat is a few hundred bytes, anything much bigger isn't worth parsing
+    if request.content_length is not None and request.content_length > config.SUBMIT_MAX_BYTES:
+        return reject('too_large', 'Payload Too Large', 413)
 
-    data = request.json
-    if "version" not in data:
-        data["version"] = "-1"
-    if "players" not in data:
-        data["players"] = 0
+    data = request.get_json(silent=True)
+    if data is None:
+        return reject('invalid_json', 'Bad Request: Invalid JSON')
+    if not isinstance(data, dict):
+        return reject('not_object', 'Bad Request: Expected a JSON object')
     
     handler_name = data.get('handler')
     
     if not StatsManager.is_valid_handler(handler_name):
-        return jsonify({'error': 'Invalid handler'}), 400
+        return reject('invalid_handler', 'Invalid handler')
+    g.metrics_handler = handler_name
 
-    success = StatsManager.add_stats(handler_name, data)
+    record, error = StatsManager.validate(handler_name, data)
+    if error:
+        return reject('invalid_record', f'Bad Request: {error}')
+
+    try:
+        success = StatsManager.add_stats(handler_name, record)
+    except BufferFullError as e:
+        return buffer_full_response(e)
     
     if success:
         return jsonify({'success': True})
+    else:
+        return reject('invalid_record', 'Failed to add stats')
+
+@api_bp.route('/submit/batch', methods=['POST'])
+@require_auth
+def submit_batch():
+    if not request.is_json:
+        return reject('not_json', 'Bad Request: Expected JSON')
+
+    records = request.get_json(silent=True)
+    if records is None:
+        return reject('invalid_json', 'Bad Request: Invalid JSON')
+    if not isinstance(records, list):
+        return reject('not_array', 'Bad Request: Expected a JSON array')
+    g.metrics_handler = 'batch'
+    if len(records) > config.SUBMIT_BATCH_MAX_RECORDS:
+        return reject('too_many_records', f'Payload Too Large: At most {config.SUBMIT_BATCH_MAX_RECORDS} records per batch', 413)
+
+    # Reject the whole batch if any record is invalid, so nothing is half-written
+    records, errors = StatsManager.validate_batch(records)
+    if errors:
+        rejections.inc(request.url_rule.rule, 'invalid_record')
+        return jsonify({'error': 'Invalid records', 'records': errors}), 400
+
+    try:
+        success = StatsManager.submit_batch(records)
+    except BufferFullError as e:
+        return buffer_full_response(e)
+
+    if success:
+        return jsonify({'success': True, 'count': len(records)})
     else:
         return jsonify({'error': 'Failed to add stats'}), 400
 
 @api_bp.route('/stats', methods=['GET'])
 @require_auth
 def get_stats():
-    stats = StatsManager.get_all_stats()
-    return jsonify(stats)
\ No newline at end of file
+    handler_names = config.ENABLED_HANDLERS
+    if request.args.get('handlers'):
+        handler_names = request.args['handlers'].split(',')
+        if not all(StatsManager.is_valid_handler(name) for name in handler_names):
+            return jsonify({'error': 'Invalid handler'}), 400
+
+    # ?window=5m|1h|24h|7d answers from the time series instead of the current hour: the servers and
+    # heartbeats seen within the window, and the one-hour window samples taken in it, see app.timeseries
+    window = request.args.get('window')
+    if window is not None:
+        try:
+            window_length = parse_window(window)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    handler_names = tuple(sorted(set(handler_names)))
+    g.metrics_handler = ','.join(handler_names)
+    cache_key = (handler_names, window)
+    cached = stats_cache.get(cache_key)
+    if cached is None:
+        if window is None:
+            try:
+                stats = StatsManager.get_all_stats(handler_names)
+            except HandlersFailedError as e:
+                # Never cached, the next request tries again
+                return jsonify({'error': f'Service Unavailable: {e}'}), 503
+        else:
+            stats = StatsManager.get_windowed_stats(window_length, handler_names)
+        cached = stats_cache.put(cache_key, json_codec.dumps(stats, sort_keys=True))
+    return etag_response(*cached)
+
+@api_bp.route('/stats/history', methods=['GET'])
+@require_auth
+def get_stats_history():
+    handler_name = request.args.get('handler')
+    if not StatsManager.is_valid_handler(handler_name):
+        return jsonify({'error': 'Invalid handler'}), 400
+    g.metrics_handler = handler_name
+
+    window = request.args.get('window', '24h')
+    try:
+        window_length = parse_window(window)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        points = int(request.args.get('points', 200))
+    except ValueError:
+        return jsonify({'error': 'points must be an integer'}), 400
+    points = max(1, min(points, config.TIMESERIES_MAX_POINTS))
+
+    cache_key = ('history', handler_name, window, points)
+    cached = stats_cache.get(cache_key)
+    if cached is None:
+        history = dict(StatsManager.get_history(handler_name, window_length, points), handler=handler_name, window=window)
+        cached = stats_cache.put(cache_key, json_codec.dumps(history, sort_keys=True))
+    return etag_response(*cached)
+
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Behind require_auth unless the scraper can't send the token
+if config.METRICS_ENABLED:
+    api_bp.add_url_rule('/metrics', 'metrics', require_auth(metrics) if config.METRICS_REQUIRE_AUTH else metrics)
+
+@require_auth
+def query_profile():
+    # DELETE starts a fresh measurement, e.g. right before a tick
+    if request.method == 'DELETE':
+        query_profiler.reset()
+        return jsonify({'success': True})
+    return jsonify(query_profiler.report())
+
+if query_profiler is not None:
+    api_bp.add_url_rule('/debug/queries', 'query_profile', query_profile, methods=['GET', 'DELETE'])
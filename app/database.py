@@ -1,3 +1,107 @@
+import os
+import tempfile
+from contextlib import contextmanager
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+import config
+from utils.metrics import instrument_engine
+from utils.query_profiler import query_profiler
 
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy()
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in config.SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
+def init_database(app):
+    db.init_app(app)
+    with app.app_context():
+        # Every pooled connection gets the storage profile before it is first used
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', _apply_sqlite_pragmas)
+        if config.METRICS_ENABLED:
+            instrument_engine(db.engine)
+        if query_profiler is not None:
+            query_profiler.attach(db.engine)
+        with schema_lock():
+            create_schema()
+
+@contextmanager
+def schema_lock():
+    # Web workers start together, one at a time checks and migrates the schema while the others wait,
+    # and finds it up to date once it gets the lock
+    try:
+        import fcntl
+    except ImportError:
+        # No flock (Windows), which also means no multi-worker servers to guard against
+        yield
+        return
+
+    path = config.SCHEMA_LOCK_FILE or os.path.join(tempfile.gettempdir(), 'stats-app-schema.lock')
+    with open(path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def create_schema():
+    db.create_all()
+    # app.labels holds a model itself, so it can only be imported once db exists
+    from app.labels import migrate_label_columns
+    migrate_label_columns()
+    create_missing_indexes()
+
+# create_all skips tables that already exist, so indexes added to existing models need creating here
+def create_missing_indexes():
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+def _insert(model):
+    dialect = db.session.get_bind().dialect.name
+    return (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(model)
+
+# INSERT ... ON CONFLICT DO NOTHING, for rows that only need to exist once
+def insert_if_missing(model, row, index_elements):
+    db.session.execute(_insert(model).values(row).on_conflict_do_nothing(index_elements=index_elements))
+
+# SQLite builds before 3.32 cap a statement at 999 bound parameters
+MAX_BOUND_PARAMETERS = 999
+
+# Multi-row INSERT ... ON CONFLICT DO UPDATE on the current session, the caller commits
+def upsert(model, rows, index_elements):
+    if not rows:
+        return
+
+    columns = list(rows[0].keys())
+    chunk_size = max(1, MAX_BOUND_PARAMETERS // len(columns))
+    for start in range(0, len(rows), chunk_size):
+        statement = _insert(model).values(rows[start:start + chunk_size])
+        statement = statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: statement.excluded[column] for column in columns if column not in index_elements}
+        )
+        db.session.execute(statement)
+
+# INSERT ... ON CONFLICT DO UPDATE that adds the rows' other columns to the stored ones. Sent as one
+# executemany, and built once per table and columns: building the excluded alias costs more than running it
+_increment_statements = {}
+
+def increment(model, rows, index_elements):
+    if not rows:
+        return
+
+    key = (db.session.get_bind().dialect.name, model.__table__, tuple(rows[0]), tuple(index_elements))
+    statement = _increment_statements.get(key)
+    if statement is None:
+        table = model.__table__
+        statement = _insert(table)
+        statement = _increment_statements[key] = statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: table.c[column] + statement.excluded[column] for column in rows[0] if column not in index_elements}
+        )
+    db.session.execute(statement, rows)
@@ -0,0 +1,189 @@
+import json
+import queue
+import random
+import threading
+import time
+import config
+from utils.metrics import registry
+
+# Discord's per-message limits
+MAX_EMBEDS = 10
+MAX_ATTACHMENTS = 10
+MAX_EMBED_CHARACTERS = 6000
+
+delivery_seconds = registry.histogram(
+    'stats_webhook_delivery_duration_seconds', 'Time from queueing a report to Discord accepting it',
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+delivery_events = registry.counter(
+    'stats_webhook_events_total', 'Webhook deliveries by outcome: sent, failed, dropped, retries, rate_limited', ('event',)
+)
+
+def build_messages(entries):
+    # entries are (embed, attachment) pairs, attachment being (filename, png bytes) or None.
+    # As many as fit go into each message, a new one starts only when a limit would be exceeded
+    messages = []
+    embeds, attachments, characters, upload_bytes = [], [], 0, 0
+
+    for embed, attachment in entries:
+        size = len(attachment[1]) if attachment else 0
+        length = len(embed.get('description', '')) + len(embed.get('title', ''))
+        if embeds and (
+            len(embeds) == MAX_EMBEDS or
+            (attachment and len(attachments) == MAX_ATTACHMENTS) or
+            characters + length > MAX_EMBED_CHARACTERS or
+            upload_bytes + size > config.WEBHOOK_MAX_UPLOAD_BYTES
+        ):
+            messages.append(_message(embeds, attachments))
+            embeds, attachments, characters, upload_bytes = [], [], 0, 0
+
+        embeds.append(embed)
+        if attachment:
+            attachments.append(attachment)
+        characters += length
+        upload_bytes += size
+
+    if embeds:
+        messages.append(_message(embeds, attachments))
+    return messages
+
+def _message(embeds, attachments):
+    payload = {
+        "content": "",
+        "embeds": embeds,
+        "attachments": [{"id": i, "filename": filename} for i, (filename, _) in enumerate(attachments)]
+    }
+    files = {
+        f'files[{i}]': (filename, image, 'image/png')
+        for i, (filename, image) in enumerate(attachments)
+    }
+    return payload, files
+
+class DiscordDelivery:
+    def __init__(self, webhook_url=None):
+        self.webhook_url = webhook_url or config.WEBHOOK_URL
+        self.queue = queue.Queue(maxsize=config.WEBHOOK_QUEUE_SIZE)
+
+        self._session = None
+        self._not_before = 0
+        registry.gauge('stats_webhook_queue_depth', 'Reports waiting to be delivered', self.queue.qsize)
+
+    @property
+    def session(self):
+        # requests is only imported once there is something to send, it isn't needed to start serving
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            # One pooled session, so every report reuses the same TLS connection
+            self._session = requests.Session()
+            self._session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+            self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        return self._session
+
+    def start(self):
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def submit(self, payload, files=None):
+        try:
+            self.queue.put_nowait((time.monotonic(), payload, files or {}))
+            return True
+        except queue.Full:
+            delivery_events.inc('dropped')
+            print("Discord delivery queue is full, dropping message")
+            return False
+
+    def _run(self):
+        while True:
+            queued_at, payload, files = self.queue.get()
+            try:
+                delivered = self._deliver(payload, files)
+            except Exception as e:
+                print(f"Failed to send message to Discord: {e}")
+                delivered = False
+
+            if delivered:
+                latency = time.monotonic() - queued_at
+                delivery_seconds.observe(latency)
+                delivery_events.inc('sent')
+                print(f"Message sent successfully")
+            else:
+                delivery_events.inc('failed')
+            self.queue.task_done()
+
+    def _backoff(self, attempt):
+        delay = min(config.WEBHOOK_BACKOFF_MAX, config.WEBHOOK_BACKOFF_BASE * 2 ** attempt)
+        return delay * random.uniform(0.5, 1)
+
+    def _deliver(self, payload, files):
+        from requests import RequestException
+
+        for attempt in range(config.WEBHOOK_MAX_ATTEMPTS):
+            if attempt:
+                delivery_events.inc('retries')
+            # Nothing follows the last attempt, so it doesn't back off
+            last_attempt = attempt == config.WEBHOOK_MAX_ATTEMPTS - 1
+
+            # Wait out the bucket if the last response said it was empty
+            wait = self._not_before - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            try:
+                response = self.session.post(
+                    self.webhook_url,
+                    data={'payload_json': json.dumps(payload)},
+                    files=files,
+                    timeout=config.WEBHOOK_TIMEOUT
+                )
+            except RequestException as e:
+                print(f"Failed to send message to Discord: {e}")
+                if not last_attempt:
+                    time.sleep(self._backoff(attempt))
+                continue
+
+            self._update_rate_limit(response)
+
+            if response.status_code == 429:
+                delivery_events.inc('rate_limited')
+                retry_after = self._retry_after(response)
+                print(f"Rate limited by Discord, retrying in {retry_after:.1f}s")
+                self._not_before = time.monotonic() + retry_after
+                continue
+
+            if response.status_code >= 500:
+                print(f"Discord returned {response.status_code}")
+                if not last_attempt:
+                    time.sleep(self._backoff(attempt))
+                continue
+
+            if response.status_code >= 400:
+                # Anything else in 4xx won't get better by retrying
+                print(f"Failed to send message to Discord: {response.status_code}")
+                if response.text:
+                    print(f"Response content: {response.text}")
+                return False
+
+            return True
+
+        print(f"Giving up on Discord message after {config.WEBHOOK_MAX_ATTEMPTS} attempts")
+        return False
+
+    def _update_rate_limit(self, response):
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            reset_after = response.headers.get('X-RateLimit-Reset-After')
+            if reset_after:
+                self._not_before = time.monotonic() + float(reset_after)
+
+    def _retry_after(self, response):
+        # Discord sends seconds both as a header and in the body, the body is more precise
+        try:
+            return float(response.json()['retry_after'])
+        except (ValueError, KeyError, TypeError):
+            pass
+        try:
+            return float(response.headers.get('Retry-After', config.WEBHOOK_BACKOFF_BASE))
+        except ValueError:
+            return config.WEBHOOK_BACKOFF_BASE
@@ -1,11 +1,19 @@
-from .resource_gatherers import ResourceGatherersHandler
-from .resource_gatherers_custom import ResourceGatherersCustomHandler
-from .build_tools import BuildToolsHandler
+import importlib
+
+# Handlers are imported by dotted path on first use, so disabled handlers never
+# define their models and never get tables created
+HANDLERS = {
+    'resource-gatherers': 'app.handlers.resource_gatherers.ResourceGatherersHandler',
+    'resource-gatherers-custom': 'app.handlers.resource_gatherers_custom.ResourceGatherersCustomHandler',
+    'build-tools': 'app.handlers.build_tools.BuildToolsHandler'
+}
 
 def get_handler(handler_name):
-    handlers = {
-        'resource-gatherers': ResourceGatherersHandler,
-        'resource-gatherers-custom': ResourceGatherersCustomHandler,
-        'build-tools': BuildToolsHandler
-    }
-    return handlers.get(handler_name)
\ No newline at end of file
+    path = HANDLERS.get(handler_name)
+    if path is None:
+        return None
+    module_name, class_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+def load_handlers(handler_names):
+    return {name: get_handler(name) for name in handler_names}
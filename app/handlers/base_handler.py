@@ -1,22 +1,440 @@
+import threading
+import time
 from abc import ABC, abstractmethod
+from sqlalchemy import case, delete, func, literal, or_, select, union_all, update
+from app.aggregates import RollingAggregate, utc_now
+from app.database import db, insert_if_missing, upsert
+from app.labels import labels
+from app.quantiles import QuantileHistograms, clear_histograms, describe
+from app.timeseries import timeseries
+from app.unique_servers import PERIODS, UniqueServers
+import config
+from utils.metrics import instrumented
+from utils.schema import compile_schema
+from utils.topk import top_with_other
 
 class BaseHandler(ABC):
+    # Model holding the latest row per server_uid, and the payload it is built from as {name: utils.schema.Field}
+    stats_model = None
+    payload_schema = {}
+
+    # Hourly samples of the window, columns named server_count, total_<sum> and max_<maximum>
+    rollup_model = None
+
+    # Append-only history of record-breaking highscores, and the single row holding the current best
+    highscore_model = None
+    best_highscore_model = None
+
+    # What the one-hour window reports: summed and maximised columns, and grouped dimensions.
+    # A dimension is stored as a <dimension>_id column referencing app.labels.Label
+    aggregate_sums = ()
+    aggregate_maxima = ()
+    aggregate_dimensions = ('server_type', 'version')
+
+    # Labels reported per dimension before the rest are folded into 'Other', DISTRIBUTION_TOP_N if not listed
+    distribution_limits = {}
+
+    # Per-server columns whose p50/p90/p99 over the window are reported
+    quantile_fields = ()
+
+    # Methods whose database time is reported per handler on /metrics, overrides included
+    instrumented_methods = (
+        'add_stats', 'add_stats_batch', 'record_ingest', 'get_stats', 'query_window_stats',
+        'rebuild_live_aggregate', 'reconcile_live_aggregate', 'write_rollup', 'prune_stale_rows',
+        'load_highscores', 'record_highscores', 'update_highscores', 'get_unique_server_counts',
+        'query_quantiles', 'prepare_quantile_histograms', 'intern_labels'
+    )
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name in cls.instrumented_methods:
+            method = getattr(cls, name, None)
+            if method is not None and not getattr(method, '__instrumented__', False):
+                setattr(cls, name, instrumented(method))
+
+    def __init__(self, name):
+        self.name = name
+        self._validate_payload = compile_schema(self.payload_schema)
+        self._highscores = None
+        self._highscores_loaded_at = 0
+        self._highscores_lock = threading.Lock()
+        self.live_aggregate = None
+        if config.LIVE_AGGREGATES_ENABLED:
+            self.live_aggregate = RollingAggregate(
+                self.aggregate_sums, self.aggregate_maxima, self.aggregate_dimensions, self.quantile_fields
+            )
+        self.unique_servers = UniqueServers(name) if config.UNIQUE_SERVERS_ENABLED else None
+        # Live aggregates hold exact quantiles, the stored histograms only cost writes a process like that never reads
+        self.quantile_histograms = None
+        if self.quantile_fields and self.live_aggregate is None:
+            self.quantile_histograms = QuantileHistograms(name, self.stats_model, self.quantile_fields)
+
     @abstractmethod
     def add_stats(self, data):
         pass
 
+    @abstractmethod
+    def build_row(self, data):
+        pass
+
+    # Returns (record, error). The record holds only the schema's fields, coerced and with defaults
+    # filled in, and is what add_stats and add_stats_batch expect
+    def validate(self, data):
+        return self._validate_payload(data)
+
+    def intern_labels(self, records):
+        # {dimension: {label: id}}, new labels are committed before any row uses them
+        return {
+            dimension: labels.intern(dimension, {data[dimension] for data in records})
+            for dimension in self.aggregate_dimensions
+        }
+
+    def apply_label_ids(self, row, label_ids):
+        for dimension in self.aggregate_dimensions:
+            row[f'{dimension}_id'] = label_ids[dimension][row.pop(dimension)]
+        return row
+
+    def add_stats_batch(self, records):
+        label_ids = self.intern_labels(records)
+
+        # Later records win when the same server reports more than once
+        rows = {}
+        for data in records:
+            row = self.apply_label_ids(self.build_row(data), label_ids)
+            rows[row['server_uid']] = row
+        rows = list(rows.values())
+        # Stamped here rather than by the database, so the live aggregate expires rows when the tables do
+        now = utc_now()
+        for row in rows:
+            row['timestamp'] = now
+        if self.quantile_histograms is not None:
+            self.quantile_histograms.record(rows)
+        upsert(self.stats_model, rows, ['server_uid'])
+        return rows
+
+    def record_ingest(self, rows):
+        # Called once the rows from add_stats_batch are committed
+        if self.unique_servers is not None:
+            try:
+                self.unique_servers.add(row['server_uid'] for row in rows)
+            except Exception as e:
+                print(f"Failed to store unique servers for {self.get_friendly_name()}: {e}")
+
+        if config.TIMESERIES_ENABLED:
+            try:
+                timeseries.count_heartbeats(self.name, len(rows))
+            except Exception as e:
+                print(f"Failed to store heartbeats for {self.get_friendly_name()}: {e}")
+
+        if self.live_aggregate is None:
+            return
+        for row in rows:
+            self.live_aggregate.update(row['server_uid'], self._aggregate_record(row), row['timestamp'])
+
+        # Catch a new peak on the heartbeat that caused it rather than at the next tick
+        if config.HIGHSCORES_ON_INGEST and self.live_aggregate.ready:
+            try:
+                self.record_highscores(self.get_highscore_values(self.live_aggregate.totals()))
+            except Exception as e:
+                db.session.rollback()
+                print(f"Failed to check highscores for {self.get_friendly_name()}: {e}")
+
     @abstractmethod
     def get_stats(self):
         pass
 
+    def _aggregate_record(self, row):
+        # The live aggregate counts label ids, they are turned back into labels when it is read
+        return {**row, **{dimension: row[f'{dimension}_id'] for dimension in self.aggregate_dimensions}}
+
+    def _label_distributions(self, distributions):
+        values = labels.values(label_id for items in distributions.values() for label_id, _ in items)
+        return {
+            dimension: sorted((values[label_id], count) for label_id, count in items)
+            for dimension, items in distributions.items()
+        }
+
+    def _live_window_stats(self, now=None):
+        window = self.live_aggregate.snapshot(now)
+        window['distributions'] = self._label_distributions(window['distributions'])
+        return window
+
+    def distribution_limit(self, dimension):
+        return self.distribution_limits.get(dimension, config.DISTRIBUTION_TOP_N)
+
+    # Servers whose latest heartbeat is within `window`, stale rows are pruned after STATS_RETENTION_DAYS
+    def count_active_servers(self, window):
+        model = self.stats_model
+        return db.session.execute(
+            select(func.count()).select_from(model).where(model.timestamp >= utc_now() - window)
+        ).scalar()
+
+    def get_window_stats(self):
+        if self.live_aggregate is not None and self.live_aggregate.ready:
+            window = self._live_window_stats()
+        else:
+            window = self.query_window_stats()
+        # Modded servers send arbitrary versions, only the most common ones are charted and stored
+        window['distributions'] = {
+            dimension: top_with_other(items, self.distribution_limit(dimension))
+            for dimension, items in window['distributions'].items()
+        }
+        return window
+
+    def query_window_stats(self, since=None):
+        model = self.stats_model
+        one_hour_ago = func.datetime('now', '-1 hour') if since is None else since
+
+        # Every scalar metric in a single scan of the window
+        row = db.session.query(
+            func.count(model.server_uid),
+            *[func.sum(getattr(model, field)) for field in self.aggregate_sums],
+            *[func.max(getattr(model, field)) for field in self.aggregate_maxima]
+        ).filter(
+            model.timestamp >= one_hour_ago
+        ).one()
+
+        sums = row[1:1 + len(self.aggregate_sums)]
+        maxima = row[1 + len(self.aggregate_sums):]
+        return {
+            'count': row[0],
+            'sums': {field: value or 0 for field, value in zip(self.aggregate_sums, sums)},
+            'maxima': dict(zip(self.aggregate_maxima, maxima)),
+            'distributions': self.get_distributions(one_hour_ago, self.aggregate_dimensions)
+        }
+
+    def get_distributions(self, since, dimensions):
+        # One grouped subquery per dimension, tagged with its name and sent as a single UNION ALL
+        model = self.stats_model
+        queries = [
+            select(
+                literal(dimension).label('dimension'),
+                getattr(model, f'{dimension}_id').label('label_id'),
+                func.count(model.server_uid).label('count')
+            ).where(
+                model.timestamp >= since
+            ).group_by(getattr(model, f'{dimension}_id'))
+            for dimension in dimensions
+        ]
+
+        distributions = {dimension: [] for dimension in dimensions}
+        for dimension, label_id, count in db.session.execute(union_all(*queries)):
+            distributions[dimension].append((label_id, count))
+        return self._label_distributions(distributions)
+
+    def get_quantiles(self):
+        if self.live_aggregate is not None and self.live_aggregate.ready:
+            return describe(self.live_aggregate.quantile_counts())
+        return self.query_quantiles()
+
+    def query_quantiles(self):
+        if self.quantile_histograms is None:
+            return {}
+        return self.quantile_histograms.query()
+
+    def prepare_quantile_histograms(self):
+        # A process with live aggregates is the only one writing and doesn't keep the histograms, so it drops
+        # them and whichever process goes without next counts them again from the stats table
+        if self.quantile_histograms is not None:
+            self.quantile_histograms.fill_if_empty()
+        elif self.quantile_fields:
+            clear_histograms(self.name)
+
+    def get_quantile_chart(self, quantiles):
+        fields = [field for field in self.quantile_fields if quantiles[field]['count']]
+        if not fields:
+            return None
+        return {
+            'title': 'Per-Server Distribution (p1 to p99)',
+            'labels': [field.replace('_', ' ').title() for field in fields],
+            'sizes': [quantiles[field]['box'] for field in fields],
+            'chart_type': 'box'
+        }
+
+    def rebuild_live_aggregate(self):
+        if self.live_aggregate is None:
+            return
+        model = self.stats_model
+        fields = list(dict.fromkeys(self.aggregate_sums + self.aggregate_maxima + self.quantile_fields))
+        dimensions = [f'{dimension}_id' for dimension in self.aggregate_dimensions]
+        self.live_aggregate.begin_rebuild()
+        try:
+            # Plain rows rather than ORM objects, the window can hold every server in the fleet
+            rows = db.session.execute(
+                select(model.server_uid, model.timestamp, *[getattr(model, column) for column in fields + dimensions]).where(
+                    model.timestamp >= func.datetime('now', '-1 hour')
+                )
+            ).all()
+        except Exception:
+            self.live_aggregate.cancel_rebuild()
+            raise
+        self.live_aggregate.rebuild(
+            (row[0], row[1], {
+                **dict(zip(fields, row[2:2 + len(fields)])),
+                **dict(zip(self.aggregate_dimensions, row[2 + len(fields):]))
+            })
+            for row in rows
+        )
+
+    def _window_drift(self, live, stored):
+        # Writes committed between reading one and the other show up as small differences,
+        # only ones larger than LIVE_AGGREGATE_DRIFT_TOLERANCE of the figure count
+        def drifted(a, b, total=None):
+            total = max(abs(a or 0), abs(b or 0)) if total is None else total
+            return abs((a or 0) - (b or 0)) > config.LIVE_AGGREGATE_DRIFT_TOLERANCE * total
+
+        drift = []
+        if drifted(live['count'], stored['count']):
+            drift.append('count')
+        drift += [field for field in self.aggregate_sums if drifted(live['sums'][field], stored['sums'][field])]
+        drift += [field for field in self.aggregate_maxima if drifted(live['maxima'][field], stored['maxima'][field])]
+        for dimension in self.aggregate_dimensions:
+            live_counts = dict(live['distributions'][dimension])
+            stored_counts = dict(stored['distributions'][dimension])
+            difference = sum(
+                abs(live_counts.get(label, 0) - stored_counts.get(label, 0))
+                for label in live_counts.keys() | stored_counts.keys()
+            )
+            if drifted(difference, 0, max(live['count'], stored['count'])):
+                drift.append(dimension)
+        return drift
+
+    def reconcile_live_aggregate(self):
+        # The database stays the source of truth, a drifted aggregate is rebuilt from it.
+        # Both sides are read for the same window start
+        if self.live_aggregate is None or not self.live_aggregate.ready:
+            return True
+        now = utc_now()
+        live = self._live_window_stats(now)
+        stored = self.query_window_stats(since=now - self.live_aggregate.window)
+        drift = self._window_drift(live, stored)
+        if not drift:
+            return True
+        print(f"Live aggregate for {self.get_friendly_name()} drifted from the database ({', '.join(drift)}), rebuilding")
+        self.rebuild_live_aggregate()
+        return False
+
+    def write_rollup(self, stats=None):
+        if self.rollup_model is None:
+            return
+        window = stats['window'] if stats else self.get_window_stats()
+        row = {
+            # Sampled at most once per scheduler tick, the latest sample in an hour wins
+            'hour': utc_now().replace(minute=0, second=0, microsecond=0),
+            'server_count': window['count'],
+            **{f'total_{field}': window['sums'][field] or 0 for field in self.aggregate_sums},
+            **{f'max_{field}': window['maxima'][field] or 0 for field in self.aggregate_maxima},
+            'timestamp': func.now()
+        }
+        upsert(self.rollup_model, [row], ['hour'])
+        db.session.commit()
+
+    def prune_stale_rows(self):
+        if not config.STATS_RETENTION_DAYS:
+            return 0
+        model = self.stats_model
+        cutoff = func.datetime('now', f'-{config.STATS_RETENTION_DAYS} days')
+
+        # Small batches with a commit in between so ingest isn't locked out for long, for at most
+        # RETENTION_MAX_SECONDS a tick so a large backlog is worked off over several
+        stop_at = time.monotonic() + config.RETENTION_MAX_SECONDS
+        deleted = 0
+        while True:
+            stale = select(model.server_uid).where(model.timestamp < cutoff).limit(config.RETENTION_BATCH_SIZE)
+            result = db.session.execute(delete(model).where(model.server_uid.in_(stale.scalar_subquery())))
+            db.session.commit()
+            deleted += result.rowcount
+            if result.rowcount < config.RETENTION_BATCH_SIZE:
+                return deleted
+            if time.monotonic() >= stop_at:
+                print(f"Deleted {deleted} stale rows for {self.get_friendly_name()}, the rest go next tick")
+                return deleted
+            time.sleep(config.RETENTION_BATCH_PAUSE)
+
+    # Distinct servers seen today, over the last 7 and the last 30 days, estimated from HyperLogLog sketches
+    def get_unique_server_counts(self):
+        if self.unique_servers is None:
+            return {period: 0 for period in PERIODS}
+        return self.unique_servers.counts()
+
     @abstractmethod
-    def update_highscores(self, stats):
+    def get_highscore_values(self, window):
         pass
 
+    def _highscore_columns(self):
+        return [column.name for column in self.best_highscore_model.__table__.columns if column.name not in ('id', 'timestamp')]
+
+    def load_highscores(self):
+        model = self.best_highscore_model
+        columns = self._highscore_columns()
+
+        if db.session.get(model, 1) is None:
+            # First run with the best row, start it from the best of the history
+            history = self.highscore_model
+            maxima = db.session.query(*[func.max(getattr(history, column)) for column in columns]).one()
+            insert_if_missing(model, {'id': 1, **{column: value or 0 for column, value in zip(columns, maxima)}}, ['id'])
+            db.session.commit()
+
+        best = db.session.query(*[getattr(model, column) for column in columns]).filter(model.id == 1).one()
+        with self._highscores_lock:
+            self._highscores = dict(zip(columns, best))
+            self._highscores_loaded_at = time.monotonic()
+        return dict(self._highscores)
+
+    def get_highscores(self):
+        # Other processes may have raised the best since, so the cached one is only trusted for a while
+        with self._highscores_lock:
+            if self._highscores is not None and time.monotonic() - self._highscores_loaded_at < config.HIGHSCORES_CACHE_TTL:
+                return dict(self._highscores)
+        return self.load_highscores()
+
+    def record_highscores(self, values):
+        # Nothing beats the cached best, so there is nothing to write
+        best = self.get_highscores()
+        if not any(values[column] > best[column] for column in values):
+            return False
+
+        # Raise each beaten column in one conditional UPDATE, safe against concurrent writers
+        model = self.best_highscore_model
+        result = db.session.execute(
+            update(model).where(
+                model.id == 1,
+                or_(*[getattr(model, column) < value for column, value in values.items()])
+            ).values({
+                # The greater of the two, spelled as a CASE since only SQLite has a two-argument max()
+                **{column: case((getattr(model, column) < value, value), else_=getattr(model, column)) for column, value in values.items()},
+                'timestamp': func.now()
+            })
+        )
+        if not result.rowcount:
+            # Another writer got there first, pick up what it recorded
+            db.session.rollback()
+            self.load_highscores()
+            return False
+
+        columns = self._highscore_columns()
+        best = dict(zip(columns, db.session.query(*[getattr(model, column) for column in columns]).filter(model.id == 1).one()))
+        db.session.add(self.highscore_model(**best))
+        db.session.commit()
+        with self._highscores_lock:
+            self._highscores = best
+            self._highscores_loaded_at = time.monotonic()
+        print("New highscore recorded!")
+        return True
+
+    # Takes the result of get_stats when the caller already has one, and returns
+    # the highscore fields of the summary as they stand afterwards
+    def update_highscores(self, stats=None):
+        window = (stats or self.get_stats())['window']
+        if not self.record_highscores(self.get_highscore_values(window)):
+            print("No new highscore.")
+        return {f'highscore_{column}': value for column, value in self.get_highscores().items()}
+
+    # Takes the result of get_stats when the caller already has one
     @abstractmethod
-    def get_formatted_stats(self):
+    def get_formatted_stats(self, stats=None):
         pass
 
     @abstractmethod
     def get_friendly_name(self):
-        pass
\ No newline at end of file
+        pass
@@ -1,74 +1,92 @@
 from app.database import db
 from .base_handler import BaseHandler
-from sqlalchemy import func
+from utils.schema import Field
 
 class ResourceGatherersStats(db.Model):
     server_uid = db.Column(db.String(100), primary_key=True)
     gatherers = db.Column(db.Integer, nullable=False)
-    server_type = db.Column(db.String(50), nullable=False)
-    version = db.Column(db.String(50), nullable=False)
+    server_type_id = db.Column(db.Integer, db.ForeignKey('label.id'), nullable=False)
+    version_id = db.Column(db.Integer, db.ForeignKey('label.id'), nullable=False)
     players = db.Column(db.Integer, nullable=False)
     timestamp = db.Column(db.DateTime, server_default=db.func.now())
 
+    # Cover the one-hour window filter together with the columns it aggregates and groups by
+    __table_args__ = (
+        db.Index('ix_resource_gatherers_stats_timestamp_metrics', 'timestamp', 'gatherers', 'players'),
+        db.Index('ix_resource_gatherers_stats_timestamp_server_type', 'timestamp', 'server_type_id'),
+        db.Index('ix_resource_gatherers_stats_timestamp_version', 'timestamp', 'version_id'),
+    )
+
 class ResourceGatherersHighscores(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     server_count = db.Column(db.Integer, nullable=False)
     total_gatherers = db.Column(db.Integer, nullable=False)
     gatherers = db.Column(db.Integer, nullable=False)
     players = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, server_default=db.func.now(), index=True)
+
+# A single row holding the current best, ResourceGatherersHighscores keeps every record it beat
+class ResourceGatherersBestHighscore(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    server_count = db.Column(db.Integer, nullable=False)
+    total_gatherers = db.Column(db.Integer, nullable=False)
+    gatherers = db.Column(db.Integer, nullable=False)
+    players = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, server_default=db.func.now())
+
+# One row per hour, sampled from the one-hour window by the scheduler
+class ResourceGatherersHourly(db.Model):
+    hour = db.Column(db.DateTime, primary_key=True)
+    server_count = db.Column(db.Integer, nullable=False)
+    total_gatherers = db.Column(db.Integer, nullable=False)
+    total_players = db.Column(db.Integer, nullable=False)
+    max_gatherers = db.Column(db.Integer, nullable=False)
     timestamp = db.Column(db.DateTime, server_default=db.func.now())
 
 class ResourceGatherersHandler(BaseHandler):
+    stats_model = ResourceGatherersStats
+    rollup_model = ResourceGatherersHourly
+    highscore_model = ResourceGatherersHighscores
+    best_highscore_model = ResourceGatherersBestHighscore
+    aggregate_sums = ('gatherers', 'players')
+    aggregate_maxima = ('gatherers',)
+    quantile_fields = ('gatherers', 'players')
+    payload_schema = {
+        'server_uid': Field(str, min_length=1, max_length=100),
+        'gatherers': Field(int, minimum=0),
+        'server_type': Field(str, max_length=50),
+        'version': Field(str, default='-1', max_length=50),
+        'players': Field(int, default=0, minimum=0)
+    }
+
     def add_stats(self, data):
-        stats = ResourceGatherersStats(
-            server_uid=data['server_uid'],
-            gatherers=data['gatherers'],
-            server_type=data['server_type'],
-            version=data['version'],
-            players=data['players'],
-            timestamp=func.now()
-        )
-        db.session.merge(stats)
+        rows = self.add_stats_batch([data])
         db.session.commit()
+        self.record_ingest(rows)
         return True
 
-    def get_stats(self):
-        one_hour_ago = func.datetime('now', '-1 hour')
-        
-        total_entries = db.session.query(func.count(ResourceGatherersStats.server_uid)).filter(
-            ResourceGatherersStats.timestamp >= one_hour_ago
-        ).scalar()
-
-        total_gatherers = db.session.query(func.sum(ResourceGatherersStats.gatherers)).filter(
-            ResourceGatherersStats.timestamp >= one_hour_ago
-        ).scalar()
-
-        total_players = db.session.query(func.sum(ResourceGatherersStats.players)).filter(
-            ResourceGatherersStats.timestamp >= one_hour_ago
-        ).scalar()
-
-        server_type_stats = db.session.query(
-            ResourceGatherersStats.server_type,
-            func.count(ResourceGatherersStats.server_uid)
-        ).filter(
-            ResourceGatherersStats.timestamp >= one_hour_ago
-        ).group_by(ResourceGatherersStats.server_type).all()
-
-        version_distribution = db.session.query(
-            ResourceGatherersStats.version,
-            func.count(ResourceGatherersStats.server_uid)
-        ).filter(
-            ResourceGatherersStats.timestamp >= one_hour_ago
-        ).group_by(ResourceGatherersStats.version).all()
-
-        highest_gatherer_count = db.session.query(func.max(ResourceGatherersStats.gatherers)).filter(
-            ResourceGatherersStats.timestamp >= one_hour_ago
-        ).scalar()
+    def build_row(self, data):
+        return {
+            'server_uid': data['server_uid'],
+            'gatherers': data['gatherers'],
+            'server_type': data['server_type'],
+            'version': data['version'],
+            'players': data['players']
+        }
 
-        # Fetch the latest highscores
-        latest_highscore = db.session.query(ResourceGatherersHighscores).order_by(
-            ResourceGatherersHighscores.timestamp.desc()
-        ).first()
+    def get_stats(self):
+        window = self.get_window_stats()
+        total_entries = window['count']
+        total_gatherers = window['sums']['gatherers']
+        total_players = window['sums']['players']
+        highest_gatherer_count = window['maxima']['gatherers']
+        server_type_stats = window['distributions']['server_type']
+        version_distribution = window['distributions']['version']
+
+        highscores = self.get_highscores()
+        unique_servers = self.get_unique_server_counts()
+        quantiles = self.get_quantiles()
+        quantile_chart = self.get_quantile_chart(quantiles)
 
         return {
             'summary': {
@@ -76,10 +94,19 @@ class ResourceGatherersHandler(BaseHandler):
                 'total_gatherers': total_gatherers or 0,
                 'total_players': total_players or 0,
                 'highest_gatherer_count': highest_gatherer_count or 0,
-                'highscore_server_count': latest_highscore.server_count if latest_highscore else 0,
-                'highscore_total_gatherers': latest_highscore.total_gatherers if latest_highscore else 0,
-                'highscore_gatherers': latest_highscore.gatherers if latest_highscore else 0,
-                'highscore_players': latest_highscore.players if latest_highscore else 0
+                'highscore_server_count': highscores['server_count'],
+                'highscore_total_gatherers': highscores['total_gatherers'],
+                'highscore_gatherers': highscores['gatherers'],
+                'highscore_players': highscores['players'],
+                'unique_servers_day': unique_servers['day'],
+                'unique_servers_week': unique_servers['week'],
+                'unique_servers_month': unique_servers['month'],
+                'gatherers_p50': quantiles['gatherers']['p50'] or 0,
+                'gatherers_p90': quantiles['gatherers']['p90'] or 0,
+                'gatherers_p99': quantiles['gatherers']['p99'] or 0,
+                'players_p50': quantiles['players']['p50'] or 0,
+                'players_p90': quantiles['players']['p90'] or 0,
+                'players_p99': quantiles['players']['p99'] or 0
             },
             'charts': [
                 {
@@ -94,50 +121,21 @@ class ResourceGatherersHandler(BaseHandler):
                     'sizes': [stat[1] for stat in version_distribution],
                     'chart_type': 'horizontal_bar'
                 }
-            ]
+            ] + ([quantile_chart] if quantile_chart else []),
+            'quantiles': quantiles,
+            'window': window
         }
 
-    def update_highscores(self):
-        current_stats = self.get_stats()['summary']
-        
-        # Query the current highscores
-        highscores = db.session.query(ResourceGatherersHighscores).order_by(
-            ResourceGatherersHighscores.server_count.desc(),
-            ResourceGatherersHighscores.total_gatherers.desc(),
-            ResourceGatherersHighscores.gatherers.desc(),
-            ResourceGatherersHighscores.players.desc()
-        ).first()
-
-        # Initialize new highscore values
-        new_highscore = {
-            'server_count': max(highscores.server_count if highscores else 0, current_stats['total_entries']),
-            'total_gatherers': max(highscores.total_gatherers if highscores else 0, current_stats['total_gatherers']),
-            'gatherers': max(highscores.gatherers if highscores else 0, current_stats['highest_gatherer_count']),
-            'players': max(highscores.players if highscores else 0, current_stats['total_players'])
+    def get_highscore_values(self, window):
+        return {
+            'server_count': window['count'],
+            'total_gatherers': window['sums']['gatherers'],
+            'gatherers': window['maxima']['gatherers'] or 0,
+            'players': window['sums']['players']
         }
 
-        # Check if any highscore was beaten
-        if (not highscores or 
-            new_highscore['server_count'] > highscores.server_count or
-            new_highscore['total_gatherers'] > highscores.total_gatherers or
-            new_highscore['gatherers'] > highscores.gatherers or
-            new_highscore['players'] > highscores.players):
-            
-            # Create and add new highscore entry
-            new_entry = ResourceGatherersHighscores(
-                server_count=new_highscore['server_count'],
-                total_gatherers=new_highscore['total_gatherers'],
-                gatherers=new_highscore['gatherers'],
-                players=new_highscore['players']
-            )
-            db.session.add(new_entry)
-            db.session.commit()
-            print("New highscore recorded!")
-        else:
-            print("No new highscore.")
-
-    def get_formatted_stats(self):
-        stats = self.get_stats()
+    def get_formatted_stats(self, stats=None):
+        stats = stats or self.get_stats()
         summary = stats['summary']
 
         formatted_stats = {
@@ -147,6 +145,13 @@ class ResourceGatherersHandler(BaseHandler):
                 f"**Number of Players:** {summary['total_players']}",
                 f"**Total Gatherers:** {summary['total_gatherers']}",
                 f"**Most Gatherers:** {summary['highest_gatherer_count']}",
+                '### Per-Server Distribution (p50 / p90 / p99)',
+                f"**Gatherers:** {summary['gatherers_p50']} / {summary['gatherers_p90']} / {summary['gatherers_p99']}",
+                f"**Players:** {summary['players_p50']} / {summary['players_p90']} / {summary['players_p99']}",
+                '### Unique Servers',
+                f"**Today:** {summary['unique_servers_day']}",
+                f"**Last 7 Days:** {summary['unique_servers_week']}",
+                f"**Last 30 Days:** {summary['unique_servers_month']}",
                 '### All-Time Highscores',
                 f"**Players:** {summary['highscore_players']}",
                 f"**Servers:** {summary['highscore_server_count']}",
@@ -0,0 +1,68 @@
+import atexit
+import math
+import threading
+import config
+
+class BufferFullError(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Ingest buffer is full")
+        self.retry_after = retry_after
+
+class IngestBuffer:
+    def __init__(self, app, write_batch):
+        self.app = app
+        self.write_batch = write_batch
+        self.max_size = config.INGEST_BUFFER_MAX_SIZE
+        self.flush_size = config.INGEST_BUFFER_FLUSH_SIZE
+        self.flush_interval = config.INGEST_BUFFER_FLUSH_INTERVAL
+
+        # Latest payload per (handler, server_uid), older heartbeats are simply replaced
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        atexit.register(self.flush)
+
+    def put_many(self, records):
+        keys = [(data['handler'], data['server_uid']) for data in records]
+        with self._lock:
+            new_keys = len(set(key for key in keys if key not in self._pending))
+            if len(self._pending) + new_keys > self.max_size:
+                raise BufferFullError(math.ceil(self.flush_interval))
+            for key, data in zip(keys, records):
+                self._pending[key] = data
+            if len(self._pending) >= self.flush_size:
+                self._wakeup.set()
+
+    def put(self, data):
+        self.put_many([data])
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Failed to flush ingest buffer: {e}")
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            with self.app.app_context():
+                success = self.write_batch(list(pending.values()))
+
+            if not success:
+                # Put the records back unless a newer heartbeat arrived in the meantime
+                with self._lock:
+                    for key, data in pending.items():
+                        self._pending.setdefault(key, data)
@@ -0,0 +1,101 @@
+import threading
+from sqlalchemy import inspect, select, text
+from app.database import MAX_BOUND_PARAMETERS, db, insert_if_missing
+
+# Every distinct server_type, version, ... string once, the stats tables store its id
+class Label(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    dimension = db.Column(db.String(50), nullable=False)
+    value = db.Column(db.String(50), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('dimension', 'value', name='uq_label_dimension_value'),
+    )
+
+class LabelDictionary:
+    def __init__(self):
+        # Only ids known to be committed are cached, so a rolled back batch can't leave one behind
+        self._ids = {}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _remember(self, dimension, pairs):
+        with self._lock:
+            for label_id, value in pairs:
+                self._ids[(dimension, value)] = label_id
+                self._values[label_id] = value
+
+    # Returns {value: id}. Unknown values are inserted and committed straight away, so call this
+    # before anything else is written in the transaction that goes on to use the ids
+    def intern(self, dimension, values):
+        values = set(values)
+        with self._lock:
+            ids = {value: self._ids[(dimension, value)] for value in values if (dimension, value) in self._ids}
+        missing = sorted(values - ids.keys())
+        if not missing:
+            return ids
+
+        chunk_size = MAX_BOUND_PARAMETERS // 2
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start:start + chunk_size]
+            insert_if_missing(Label, [{'dimension': dimension, 'value': value} for value in chunk], ['dimension', 'value'])
+        db.session.commit()
+
+        found = []
+        for start in range(0, len(missing), MAX_BOUND_PARAMETERS - 1):
+            found += db.session.execute(
+                select(Label.id, Label.value).where(
+                    Label.dimension == dimension,
+                    Label.value.in_(missing[start:start + MAX_BOUND_PARAMETERS - 1])
+                )
+            ).all()
+        self._remember(dimension, found)
+        ids.update((value, label_id) for label_id, value in found)
+        return ids
+
+    # Returns {id: value}, ids written by another process are looked up once
+    def values(self, ids):
+        ids = set(ids)
+        with self._lock:
+            values = {label_id: self._values[label_id] for label_id in ids if label_id in self._values}
+        missing = sorted(ids - values.keys())
+        for start in range(0, len(missing), MAX_BOUND_PARAMETERS):
+            for label_id, dimension, value in db.session.execute(
+                select(Label.id, Label.dimension, Label.value).where(Label.id.in_(missing[start:start + MAX_BOUND_PARAMETERS]))
+            ):
+                self._remember(dimension, [(label_id, value)])
+                values[label_id] = value
+        return values
+
+labels = LabelDictionary()
+
+# Stats tables created before labels were interned hold the strings themselves. For every
+# <dimension>_id column referencing the label table that the database doesn't have yet, add it,
+# fill it from the old <dimension> column and drop that. create_all doesn't alter existing tables,
+# so migrated columns stay nullable
+def migrate_label_columns():
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if table.name == Label.__tablename__ or not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if not any(key.column.table.name == Label.__tablename__ for key in column.foreign_keys):
+                continue
+            dimension = column.name[:-len('_id')]
+            if column.name in existing or dimension not in existing:
+                continue
+
+            print(f"Migrating {table.name}.{dimension} to label ids")
+            labels.intern(dimension, db.session.execute(text(f'SELECT DISTINCT {dimension} FROM {table.name}')).scalars())
+            db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} INTEGER REFERENCES label (id)'))
+            db.session.execute(text(
+                f'UPDATE {table.name} SET {column.name} = '
+                f'(SELECT id FROM label WHERE dimension = :dimension AND value = {table.name}.{dimension})'
+            ), {'dimension': dimension})
+            # The old column can't be dropped while an index still covers it
+            for index in inspector.get_indexes(table.name):
+                if dimension in index['column_names']:
+                    db.session.execute(text(f'DROP INDEX {index["name"]}'))
+            db.session.execute(text(f'ALTER TABLE {table.name} DROP COLUMN {dimension}'))
+            db.session.commit()
@@ -0,0 +1,145 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, select
+from app.aggregates import utc_now
+from app.database import MAX_BOUND_PARAMETERS, db, increment
+import config
+from utils.value_buckets import ValueBuckets, weighted_quantiles
+
+# Quantiles reported for every field, and the spread shown by box charts
+REPORTED_QUANTILES = {'p50': 0.5, 'p90': 0.9, 'p99': 0.99}
+BOX_QUANTILES = (0.01, 0.25, 0.5, 0.75, 0.99)
+
+EPOCH = datetime(1970, 1, 1)
+
+# Servers per value of a quantile field, by the time bucket their latest row was written in.
+# A server moves out of its old bucket when it reports again, so each one counts once
+class QuantileBucket(db.Model):
+    handler = db.Column(db.String(50), primary_key=True)
+    field = db.Column(db.String(50), primary_key=True)
+    # Start of the time bucket in seconds since the epoch, and the utils.value_buckets key of the value
+    bucket = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+
+def describe(counts):
+    # counts are {field: [(value, servers)]} sorted by value
+    return {
+        field: {
+            'count': sum(servers for _, servers in items),
+            **dict(zip(REPORTED_QUANTILES, weighted_quantiles(items, REPORTED_QUANTILES.values()))),
+            'box': weighted_quantiles(items, BOX_QUANTILES)
+        }
+        for field, items in counts.items()
+    }
+
+class QuantileHistograms:
+    # Kept up to date on every write so the quantiles of the window are read from a few hundred rows
+    # rather than every stats row. The window covers every time bucket it overlaps, so it is up to
+    # one bucket longer than an hour.
+    # Only processes without live aggregates keep them, see BaseHandler.prepare_quantile_histograms
+    def __init__(self, handler_name, model, fields, window=timedelta(hours=1)):
+        self.handler_name = handler_name
+        self.model = model
+        self.fields = tuple(fields)
+        self.window = window
+        self.bucket_seconds = config.QUANTILE_BUCKET_SECONDS
+        self.value_buckets = ValueBuckets(config.QUANTILE_RELATIVE_ACCURACY)
+
+    def _bucket(self, timestamp):
+        seconds = int((timestamp - EPOCH).total_seconds())
+        return seconds - seconds % self.bucket_seconds
+
+    def _oldest_bucket(self):
+        return self._bucket(utc_now() - self.window)
+
+    def _count(self, changes, timestamp, values, servers):
+        bucket = self._bucket(timestamp)
+        for field, value in zip(self.fields, values):
+            if value is not None:
+                changes[(field, bucket, self.value_buckets.key(value))] += servers
+
+    def _apply(self, changes):
+        increment(QuantileBucket, [
+            {'handler': self.handler_name, 'field': field, 'bucket': bucket, 'key': key, 'count': count}
+            for (field, bucket, key), count in changes.items() if count
+        ], ['handler', 'field', 'bucket', 'key'])
+
+    # rows are the stamped stats rows about to be upserted, one per server, in the same transaction.
+    # The new values are added first: on SQLite that write takes the database's write lock, so the
+    # previous rows read next can't change before commit. Other databases lock them FOR UPDATE
+    def record(self, rows):
+        changes = Counter()
+        for row in rows:
+            self._count(changes, row['timestamp'], [row[field] for field in self.fields], 1)
+        self._apply(changes)
+
+        changes = Counter()
+        oldest = self._oldest_bucket()
+        server_uids = [row['server_uid'] for row in rows]
+        # Read through the table rather than the model, this runs on every write and skips the ORM's overhead
+        table = self.model.__table__
+        columns = [table.c[field] for field in self.fields]
+        for start in range(0, len(server_uids), MAX_BOUND_PARAMETERS):
+            for timestamp, *values in db.session.execute(
+                select(table.c.timestamp, *columns).where(
+                    table.c.server_uid.in_(server_uids[start:start + MAX_BOUND_PARAMETERS])
+                ).with_for_update()
+            ):
+                # Buckets that left the window are pruned, there is nothing to take the server out of
+                if self._bucket(timestamp) >= oldest:
+                    self._count(changes, timestamp, values, -1)
+        self._apply(changes)
+
+    def query(self):
+        counts = {field: [] for field in self.fields}
+        for field, key, count in db.session.execute(
+            select(QuantileBucket.field, QuantileBucket.key, func.sum(QuantileBucket.count)).where(
+                QuantileBucket.handler == self.handler_name,
+                QuantileBucket.bucket >= self._oldest_bucket()
+            ).group_by(QuantileBucket.field, QuantileBucket.key).order_by(QuantileBucket.field, QuantileBucket.key)
+        ):
+            if field in counts and count > 0:
+                counts[field].append((self.value_buckets.value(key), count))
+        return describe(counts)
+
+    def prune(self, commit=True):
+        result = db.session.execute(
+            delete(QuantileBucket).where(
+                QuantileBucket.handler == self.handler_name,
+                QuantileBucket.bucket < self._oldest_bucket()
+            )
+        )
+        if commit:
+            db.session.commit()
+        return result.rowcount
+
+    def backfill(self):
+        # Counts the rows already in the window, the caller commits
+        changes = Counter()
+        servers = 0
+        columns = [getattr(self.model, field) for field in self.fields]
+        for timestamp, *values in db.session.execute(
+            select(self.model.timestamp, *columns).where(
+                self.model.timestamp >= EPOCH + timedelta(seconds=self._oldest_bucket())
+            ).execution_options(yield_per=config.QUANTILE_SCAN_BATCH_SIZE)
+        ):
+            self._count(changes, timestamp, values, 1)
+            servers += 1
+        self._apply(changes)
+        return servers
+
+    def fill_if_empty(self):
+        # Pruning first takes SQLite's write lock, so no write lands between finding nothing and counting the rows
+        self.prune(commit=False)
+        empty = db.session.execute(
+            select(QuantileBucket.handler).where(QuantileBucket.handler == self.handler_name).limit(1)
+        ).first() is None
+        servers = self.backfill() if empty else 0
+        db.session.commit()
+        if servers:
+            print(f"Filled quantile histograms for {self.handler_name} from {servers} servers")
+
+def clear_histograms(handler_name):
+    db.session.execute(delete(QuantileBucket).where(QuantileBucket.handler == handler_name))
+    db.session.commit()
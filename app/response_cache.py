@@ -0,0 +1,31 @@
+import hashlib
+import threading
+import time
+import config
+
+class ResponseCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1], entry[2]
+
+    def put(self, key, body):
+        # The ETag is derived from the body, so identical stats keep the same tag across refreshes
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, body, etag)
+        return body, etag
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+stats_cache = ResponseCache(config.STATS_CACHE_TTL)
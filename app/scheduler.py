@@ -0,0 +1,32 @@
+import os
+import tempfile
+import config
+
+_lock_file = None
+
+def acquire_scheduler_lock():
+    # Held for the life of the process, so when several workers start only the first one schedules
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    try:
+        import fcntl
+    except ImportError:
+        # No flock (Windows), which also means no multi-worker servers to guard against
+        return True
+
+    path = config.SCHEDULER_LOCK_FILE or os.path.join(tempfile.gettempdir(), 'stats-app-scheduler.lock')
+    lock_file = open(path, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    return True
+
+def should_run_scheduler():
+    if config.SCHEDULER_MODE == 'embedded':
+        return acquire_scheduler_lock()
+    # 'separate' runs it from scheduler.py, 'off' not at all
+    return False
@@ -0,0 +1,21 @@
+import time
+from dataclasses import dataclass, field
+
+# Everything a handler reported in one scheduler tick. Highscore checks, formatting, charts
+# and /stats all read the same snapshot until the next tick replaces it, so treat it as read-only
+@dataclass(frozen=True)
+class StatsSnapshot:
+    handler_name: str
+    stats: dict
+    formatted: dict
+    taken_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def age(self):
+        return time.monotonic() - self.taken_at
+
+    @classmethod
+    def take(cls, handler):
+        stats = handler.get_stats()
+        stats['summary'].update(handler.update_highscores(stats))
+        return cls(handler.name, stats, handler.get_formatted_stats(stats))
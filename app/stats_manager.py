@@ -1,11 +1,27 @@
 import threading
 import time
-import requests
-import json
-import base64
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from app.handlers import get_handler
+from app.database import db
+from app.discord_delivery import DiscordDelivery, build_messages
+from app.ingest_buffer import IngestBuffer
+from app.response_cache import stats_cache
+from app.snapshot import StatsSnapshot
+from app.timeseries import timeseries
+from sqlalchemy.exc import SQLAlchemyError
 import config
-from utils.chart_helper import create_charts
+from utils.chart_helper import start_chart_pool, submit_charts
+from utils.metrics import registry
+
+tick_seconds = registry.histogram(
+    'stats_scheduler_tick_duration_seconds', 'Time taken by a full scheduler tick, reporting included',
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+
+class HandlersFailedError(Exception):
+    def __init__(self, handler_names):
+        super().__init__(f"Stats unavailable for: {', '.join(handler_names)}")
+        self.handler_names = handler_names
 
 class StatsManager:
     _instance = None
@@ -14,85 +30,276 @@ class StatsManager:
         if cls._instance is None:
             cls._instance = super(StatsManager, cls).__new__(cls)
             cls._instance.app = app
-            cls._instance.handlers = {name: get_handler(name)() for name in config.ENABLED_HANDLERS}
+            cls._instance.handlers = {name: get_handler(name)(name) for name in config.ENABLED_HANDLERS}
+            cls._instance.snapshots = {}
+            cls._instance.ingest_buffer = IngestBuffer(app, cls.add_stats_batch) if config.INGEST_BUFFER_ENABLED else None
+            cls._instance.delivery = DiscordDelivery()
+            cls._instance.executor = ThreadPoolExecutor(max_workers=config.STATS_WORKERS, thread_name_prefix='stats-handler')
         return cls._instance
 
-    def start(self):
+    def start(self, run_scheduler=True):
+        # Live aggregates start from what is already in the window
+        with self.app.app_context():
+            for handler in self.handlers.values():
+                handler.rebuild_live_aggregate()
+                handler.prepare_quantile_histograms()
+                handler.load_highscores()
+
+        if self.ingest_buffer:
+            self.ingest_buffer.start()
+
+        # Only one process in a deployment reports, see app.scheduler
+        if not run_scheduler:
+            return
+
+        start_chart_pool()
+        self.delivery.start()
+
+        # How far behind schedule the tick that is due now is, it keeps growing if the scheduler stalls
+        self._next_tick_due = time.monotonic()
+        registry.gauge(
+            'stats_scheduler_tick_lag_seconds', 'Seconds the due scheduler tick is running behind',
+            lambda: max(0, time.monotonic() - self._next_tick_due)
+        )
+
         thread = threading.Thread(target=self._run_periodic_tasks)
         thread.daemon = True
         thread.start()
 
+        if config.TIMESERIES_ENABLED:
+            thread = threading.Thread(target=self._run_timeseries_sampler)
+            thread.daemon = True
+            thread.start()
+
     def _run_periodic_tasks(self):
         while True:
-            with self.app.app_context():
-                for handler in self.handlers.values():
-                    handler.update_highscores()
-                self.collect_and_send_stats()
+            with tick_seconds.time():
+                self.run_tick()
+            self._next_tick_due = time.monotonic() + config.STATS_INTERVAL
             time.sleep(config.STATS_INTERVAL)
 
+    def run_tick(self):
+        self.snapshots = self.map_handlers(self._run_handler_tasks)
+        stats_cache.invalidate()
+        with self.app.app_context():
+            self.collect_and_send_stats(
+                {name: snapshot.formatted for name, snapshot in self.snapshots.items()}
+            )
+        # Once the report is out, with a deadline of its own so a backlog of stale rows can't cost a report
+        self.map_handlers(self._run_handler_maintenance, timeout=config.RETENTION_MAX_SECONDS + config.HANDLER_TIMEOUT)
+
+    def _run_timeseries_sampler(self):
+        last_pruned = None
+        while True:
+            # Sample on the interval boundary so buckets line up with wall-clock minutes
+            time.sleep(config.TIMESERIES_INTERVAL - time.time() % config.TIMESERIES_INTERVAL)
+            with self.app.app_context():
+                try:
+                    timeseries.flush_activity()
+                except Exception as e:
+                    print(f"Failed to store heartbeats: {e}")
+                for name, handler in self.handlers.items():
+                    try:
+                        timeseries.record(name, handler.get_window_stats())
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"Failed to record time series for {name}: {e}")
+
+                # Old buckets only need clearing out once an hour
+                hour = int(time.time() // 3600)
+                if hour != last_pruned:
+                    try:
+                        timeseries.prune()
+                        last_pruned = hour
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"Failed to prune time series: {e}")
+
+    @staticmethod
+    def _run_handler_tasks(handler):
+        handler.reconcile_live_aggregate()
+        if handler.unique_servers is not None:
+            handler.unique_servers.flush()
+        snapshot = StatsSnapshot.take(handler)
+        handler.write_rollup(snapshot.stats)
+        return snapshot
+
+    @staticmethod
+    def _run_handler_maintenance(handler):
+        handler.prune_stale_rows()
+        if handler.unique_servers is not None:
+            handler.unique_servers.prune()
+        if handler.quantile_histograms is not None:
+            handler.quantile_histograms.prune()
+
+    def _call_in_app_context(self, func, handler):
+        # Each worker gets its own app context, and with it its own scoped session
+        with self.app.app_context():
+            return func(handler)
+
+    # Handlers that fail or time out are logged and left out, or with partial=False raise HandlersFailedError
+    def map_handlers(self, func, handler_names=None, partial=True, timeout=None):
+        if handler_names is None:
+            handler_names = list(self.handlers)
+        if timeout is None:
+            timeout = config.HANDLER_TIMEOUT
+        futures = {
+            name: self.executor.submit(self._call_in_app_context, func, self.handlers[name])
+            for name in handler_names
+        }
+
+        # Handlers run side by side, so each one gets the same deadline rather than its own slot
+        deadline = time.monotonic() + timeout
+        results = {}
+        failed = []
+        for name, future in futures.items():
+            try:
+                results[name] = future.result(timeout=max(0, deadline - time.monotonic()))
+            except TimeoutError:
+                print(f"Handler {name} timed out after {timeout} seconds")
+                failed.append(name)
+            except Exception as e:
+                print(f"Handler {name} failed: {e}")
+                failed.append(name)
+        if failed and not partial:
+            raise HandlersFailedError(failed)
+        return results
+
     @classmethod
     def is_valid_handler(cls, handler_name):
         return handler_name in config.ENABLED_HANDLERS
 
     @classmethod
-    def add_stats(cls, handler_name, data):
+    def validate(cls, handler_name, data):
+        return cls._instance.handlers[handler_name].validate(data)
+
+    # Takes a record returned by validate
+    @classmethod
+    def add_stats(cls, handler_name, record):
         handler = cls._instance.handlers[handler_name]
-        return handler.add_stats(data)
+        if cls._instance.ingest_buffer:
+            cls._instance.ingest_buffer.put(dict(record, handler=handler_name))
+            return True
+        success = handler.add_stats(record)
+        cls._invalidate_cached_stats()
+        return success
+
+    @staticmethod
+    def _invalidate_cached_stats():
+        if config.STATS_CACHE_INVALIDATE_ON_WRITE:
+            stats_cache.invalidate()
 
+    # Returns the validated records, each tagged with its handler, and the errors by index
     @classmethod
-    def get_all_stats(cls):
-        return {name: cls._instance.handlers[name].get_formatted_stats() for name in cls._instance.handlers}
+    def validate_batch(cls, records):
+        valid, errors = [], []
+        for index, data in enumerate(records):
+            if not isinstance(data, dict):
+                error = 'Expected a JSON object'
+            elif not cls.is_valid_handler(data.get('handler')):
+                error = 'Invalid handler'
+            else:
+                record, error = cls.validate(data['handler'], data)
+                if record is not None:
+                    valid.append(dict(record, handler=data['handler']))
+            if error:
+                errors.append({'index': index, 'error': error})
+        return valid, errors
+
+    @classmethod
+    def submit_batch(cls, records):
+        if cls._instance.ingest_buffer:
+            cls._instance.ingest_buffer.put_many(records)
+            return True
+        return cls.add_stats_batch(records)
+
+    @classmethod
+    def add_stats_batch(cls, records):
+        records_by_handler = {}
+        for data in records:
+            records_by_handler.setdefault(data['handler'], []).append(data)
+
+        # One transaction for the whole batch, one upsert per handler
+        written = {}
+        try:
+            # New labels are committed on their own first, see app.labels
+            for handler_name, handler_records in records_by_handler.items():
+                cls._instance.handlers[handler_name].intern_labels(handler_records)
+            for handler_name, handler_records in records_by_handler.items():
+                written[handler_name] = cls._instance.handlers[handler_name].add_stats_batch(handler_records)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f"Failed to add stats batch: {e}")
+            return False
+
+        for handler_name, rows in written.items():
+            cls._instance.handlers[handler_name].record_ingest(rows)
+        cls._invalidate_cached_stats()
+        return True
+
+    # Only the scheduled report settles for partial stats, /stats answers with all of them or an error
+    @classmethod
+    def get_all_stats(cls, handler_names=None, partial=False):
+        if handler_names is None:
+            handler_names = list(cls._instance.handlers)
+
+        # Serve the last tick's numbers while they are fresh enough, so every reader agrees
+        snapshots = cls._instance.snapshots
+        if config.STATS_SNAPSHOT_MAX_AGE and all(name in snapshots and snapshots[name].age <= config.STATS_SNAPSHOT_MAX_AGE for name in handler_names):
+            return {name: snapshots[name].formatted for name in handler_names}
+        return cls._instance.map_handlers(lambda handler: handler.get_formatted_stats(), handler_names, partial)
 
-    def collect_and_send_stats(self):
-        all_stats = self.get_all_stats()
+    @classmethod
+    def get_windowed_stats(cls, window, handler_names=None):
+        # Read from the time series rather than the stats tables, see app.timeseries
+        if handler_names is None:
+            handler_names = list(cls._instance.handlers)
+        stats = {}
+        for name in handler_names:
+            stats[name] = timeseries.summarize(name, window)
+            stats[name]['activity']['servers'] = cls._instance.handlers[name].count_active_servers(window)
+        return stats
+
+    @classmethod
+    def get_history(cls, handler_name, window, points):
+        return timeseries.history(handler_name, window, points)
+
+    def collect_and_send_stats(self, all_stats=None):
+        if all_stats is None:
+            all_stats = self.get_all_stats(partial=True)
+
+        # Render every handler's charts at once, off this thread
+        chart_futures = {
+            handler_name: submit_charts(stats['charts'])
+            for handler_name, stats in all_stats.items() if stats.get('charts')
+        }
+
+        entries = []
         for handler_name, stats in all_stats.items():
             handler = self.handlers[handler_name]
             
             # Create charts
-            charts_data = stats.get('charts', [])
-            if charts_data:
-                chart_image = create_charts(charts_data)
-            else:
-                chart_image = None
+            chart_image = None
+            if handler_name in chart_futures:
+                try:
+                    chart_image = chart_futures[handler_name].result(timeout=config.CHART_RENDER_TIMEOUT)
+                except Exception as e:
+                    print(f"Failed to render charts for {handler_name}: {e}")
 
             # Prepare the message
             message = f"## {handler.get_friendly_name()} Stats\n"
             for value in stats['summary']:
                 message += f"{value}\n"
 
-            # Send message to Discord
-            self.send_discord_message(message, chart_image)
-
-    def send_discord_message(self, content, image_data=None):
-        payload = {
-            "content": "",
-            "embeds": [
-                {
-                    "description": content,
-                    "image": {"url": "attachment://chart.png"}
-                }
-            ]
-        }
-
-        files = {}
-        
-        if image_data:
-            # Remove the "data:image/png;base64," prefix
-            image_data = image_data.split(',')[1]
-            image_binary = base64.b64decode(image_data)
-            files = {
-                'file': ('chart.png', image_binary, 'image/png')
-            }
+            embed = {"description": message}
+            attachment = None
+            if chart_image:
+                filename = f"chart-{handler_name}.png"
+                embed["image"] = {"url": f"attachment://{filename}"}
+                attachment = (filename, chart_image)
+            entries.append((embed, attachment))
 
-        try:
-            response = requests.post(
-                config.WEBHOOK_URL,
-                data={'payload_json': (None, json.dumps(payload), 'multipart/form-data')},
-                files=files
-            )
-            response.raise_for_status()
-            print(f"Message sent successfully")
-        except requests.RequestException as e:
-            print(f"Failed to send message to Discord: {e}")
-            if response.text:
-                print(f"Response content: {response.text}")
\ No newline at end of file
+        # Every handler goes out in as few webhook calls as Discord's limits allow
+        for payload, files in build_messages(entries):
+            self.delivery.submit(payload, files)
@@ -0,0 +1,269 @@
+import re
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from sqlalchemy import delete, select
+from app.aggregates import utc_now
+from app.database import db, increment, upsert
+import config
+
+# Samples of each handler's one-hour window. 'minute' rows are one sample each, 'hour' rows hold
+# the peak of the minute samples in that hour (and the latest distributions) and are kept for longer
+class StatsTimeseries(db.Model):
+    handler = db.Column(db.String(50), primary_key=True)
+    resolution = db.Column(db.String(10), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    server_count = db.Column(db.Integer, nullable=False)
+    sums = db.Column(db.JSON, nullable=False)
+    maxima = db.Column(db.JSON, nullable=False)
+    distributions = db.Column(db.JSON, nullable=False)
+
+# Heartbeats received per handler, counted on the ingest path. Unlike the samples these add up, so the
+# buckets within a window count the heartbeats inside it. 'hour' rows are kept as long as hourly samples
+class StatsActivity(db.Model):
+    handler = db.Column(db.String(50), primary_key=True)
+    resolution = db.Column(db.String(10), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    heartbeats = db.Column(db.Integer, nullable=False)
+
+# What every sample describes, the handlers' one-hour window
+SAMPLE_WINDOW = '1h'
+
+RESOLUTIONS = {
+    'minute': timedelta(minutes=1),
+    'hour': timedelta(hours=1)
+}
+
+_WINDOW = re.compile(r'^(\d+)([mhd])$')
+_WINDOW_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+
+def parse_window(value):
+    # '5m', '1h', '24h', '7d', ...
+    match = _WINDOW.match(value or '')
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"Invalid window: {value}")
+    window = timedelta(**{_WINDOW_UNITS[match.group(2)]: int(match.group(1))})
+    if window > timedelta(days=config.TIMESERIES_HOUR_RETENTION_DAYS):
+        raise ValueError(f"Window {value} is longer than the {config.TIMESERIES_HOUR_RETENTION_DAYS} days kept")
+    return window
+
+def _peak(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+def _merge_peaks(current, sample):
+    return {
+        'server_count': max(current['server_count'], sample['server_count']),
+        'sums': {field: _peak(current['sums'].get(field), value) for field, value in sample['sums'].items()},
+        'maxima': {field: _peak(current['maxima'].get(field), value) for field, value in sample['maxima'].items()},
+        'distributions': sample['distributions']
+    }
+
+def _sample_row(window):
+    return {
+        'server_count': window['count'],
+        'sums': dict(window['sums']),
+        'maxima': dict(window['maxima']),
+        'distributions': {dimension: [list(item) for item in items] for dimension, items in window['distributions'].items()}
+    }
+
+class TimeseriesStore:
+    def __init__(self):
+        # Running peak of the current hour per handler, so each sample is one upsert per resolution
+        self._hours = {}
+        self._lock = threading.Lock()
+        # Heartbeats not yet stored, by (handler, minute). Every process counts its own and adds them in
+        self._activity = Counter()
+        self._activity_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def count_heartbeats(self, handler_name, count, now=None):
+        minute = (now or utc_now()).replace(second=0, microsecond=0)
+        with self._activity_lock:
+            self._activity[(handler_name, minute)] += count
+            due = time.monotonic() - self._last_flush >= config.TIMESERIES_ACTIVITY_FLUSH_INTERVAL
+        if due:
+            self.flush_activity()
+
+    def flush_activity(self):
+        with self._flush_lock:
+            with self._activity_lock:
+                pending, self._activity = self._activity, Counter()
+                self._last_flush = time.monotonic()
+            if not pending:
+                return
+
+            buckets = Counter()
+            for (handler_name, minute), count in pending.items():
+                buckets[(handler_name, 'minute', minute)] += count
+                buckets[(handler_name, 'hour', minute.replace(minute=0))] += count
+            try:
+                increment(StatsActivity, [
+                    {'handler': handler_name, 'resolution': resolution, 'bucket': bucket, 'heartbeats': count}
+                    for (handler_name, resolution, bucket), count in buckets.items()
+                ], ['handler', 'resolution', 'bucket'])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # Put them back for the next flush
+                with self._activity_lock:
+                    self._activity.update(pending)
+                raise
+
+    def record(self, handler_name, window, now=None):
+        now = now or utc_now()
+        minute = now.replace(second=0, microsecond=0)
+        hour = minute.replace(minute=0)
+        sample = _sample_row(window)
+
+        with self._lock:
+            current = self._hours.get(handler_name)
+            if current is None or current[0] != hour:
+                # After a restart, carry on from what was already recorded for this hour
+                stored = db.session.get(StatsTimeseries, (handler_name, 'hour', hour))
+                current = (hour, {
+                    'server_count': stored.server_count, 'sums': stored.sums,
+                    'maxima': stored.maxima, 'distributions': stored.distributions
+                } if stored else sample)
+            current = (hour, _merge_peaks(current[1], sample))
+            self._hours[handler_name] = current
+
+        index_elements = ['handler', 'resolution', 'bucket']
+        upsert(StatsTimeseries, [dict(sample, handler=handler_name, resolution='minute', bucket=minute)], index_elements)
+        upsert(StatsTimeseries, [dict(current[1], handler=handler_name, resolution='hour', bucket=hour)], index_elements)
+        db.session.commit()
+
+    def prune(self, now=None):
+        now = now or utc_now()
+        retention = {
+            'minute': timedelta(hours=config.TIMESERIES_MINUTE_RETENTION_HOURS),
+            'hour': timedelta(days=config.TIMESERIES_HOUR_RETENTION_DAYS)
+        }
+        deleted = 0
+        for model in (StatsTimeseries, StatsActivity):
+            for resolution, keep in retention.items():
+                result = db.session.execute(delete(model).where(
+                    model.resolution == resolution,
+                    model.bucket < now - keep
+                ))
+                deleted += result.rowcount
+        db.session.commit()
+        return deleted
+
+    def resolution_for(self, window):
+        # Minute samples while they are both kept and few enough, hourly peaks beyond that
+        minute_limit = min(
+            timedelta(hours=config.TIMESERIES_MINUTE_RETENTION_HOURS),
+            timedelta(minutes=config.TIMESERIES_MAX_MINUTE_BUCKETS)
+        )
+        return 'minute' if window <= minute_limit else 'hour'
+
+    def _since(self, resolution, window, now):
+        # An hour bucket is stamped with its start, so include the one the window starts in
+        return now - window - (RESOLUTIONS[resolution] - RESOLUTIONS['minute'])
+
+    def buckets(self, handler_name, window, now=None):
+        now = now or utc_now()
+        resolution = self.resolution_for(window)
+        since = self._since(resolution, window, now)
+        rows = db.session.execute(
+            select(StatsTimeseries).where(
+                StatsTimeseries.handler == handler_name,
+                StatsTimeseries.resolution == resolution,
+                StatsTimeseries.bucket > since
+            ).order_by(StatsTimeseries.bucket)
+        ).scalars().all()
+        return resolution, rows
+
+    def activity(self, handler_name, resolution, since):
+        return db.session.execute(
+            select(StatsActivity.bucket, StatsActivity.heartbeats).where(
+                StatsActivity.handler == handler_name,
+                StatsActivity.resolution == resolution,
+                StatsActivity.bucket > since
+            ).order_by(StatsActivity.bucket)
+        ).all()
+
+    def latest(self, handler_name):
+        return db.session.execute(
+            select(StatsTimeseries).where(
+                StatsTimeseries.handler == handler_name,
+                StatsTimeseries.resolution == 'minute'
+            ).order_by(StatsTimeseries.bucket.desc()).limit(1)
+        ).scalar()
+
+    # What happened within `window`: the heartbeats received, counted in whole buckets. Alongside it the
+    # latest sample and the peaks among the samples taken within `window`. Every sample is of the one-hour
+    # window whatever `window` is, a short window narrows which samples count, not what they cover
+    def summarize(self, handler_name, window, now=None):
+        now = now or utc_now()
+        resolution, rows = self.buckets(handler_name, window, now)
+        heartbeats = sum(count for _, count in self.activity(handler_name, resolution, self._since(resolution, window, now)))
+        summary = {
+            'resolution': resolution, 'activity': {'heartbeats': heartbeats},
+            'sample_window': SAMPLE_WINDOW, 'buckets': len(rows), 'latest': None, 'peak': None
+        }
+        if not rows:
+            return summary
+
+        latest = rows[-1]
+        if resolution != 'minute':
+            # Hour buckets hold peaks, the latest sample is the newest minute bucket
+            latest = self.latest(handler_name) or latest
+        peak = {'server_count': 0, 'sums': {}, 'maxima': {}, 'distributions': None}
+        for row in rows:
+            peak = _merge_peaks(peak, {'server_count': row.server_count, 'sums': row.sums, 'maxima': row.maxima, 'distributions': None})
+        summary['from'] = rows[0].bucket.isoformat()
+        summary['to'] = rows[-1].bucket.isoformat()
+        summary['latest'] = {
+            'server_count': latest.server_count,
+            'sums': latest.sums,
+            'maxima': latest.maxima,
+            'distributions': latest.distributions
+        }
+        summary['peak'] = {key: peak[key] for key in ('server_count', 'sums', 'maxima')}
+        return summary
+
+    def history(self, handler_name, window, points, now=None):
+        # Downsampled to at most `points` evenly spaced slots, each keeping the peak of the samples in it
+        # and the heartbeats received in it
+        now = (now or utc_now()).replace(second=0, microsecond=0)
+        resolution, rows = self.buckets(handler_name, window, now)
+        start = now - window
+        width = max(window / points, RESOLUTIONS[resolution])
+
+        def slot_index(bucket):
+            # The last bucket starts at `now`, which would be one past the last slot
+            return min(points - 1, max(0, int((bucket - start) / width)))
+
+        slots = {}
+        for row in rows:
+            index = slot_index(row.bucket)
+            sample = {'server_count': row.server_count, 'sums': row.sums, 'maxima': row.maxima, 'distributions': None}
+            slots[index] = _merge_peaks(slots[index], sample) if index in slots else sample
+
+        heartbeats = Counter()
+        for bucket, count in self.activity(handler_name, resolution, self._since(resolution, window, now)):
+            heartbeats[slot_index(bucket)] += count
+
+        empty = {'server_count': None, 'sums': None, 'maxima': None}
+        return {
+            'resolution': resolution,
+            'points': [
+                {
+                    'time': (start + index * width).isoformat(),
+                    'heartbeats': heartbeats[index],
+                    'server_count': slots.get(index, empty)['server_count'],
+                    'sums': slots.get(index, empty)['sums'],
+                    'maxima': slots.get(index, empty)['maxima']
+                }
+                for index in sorted(slots.keys() | heartbeats.keys())
+            ]
+        }
+
+timeseries = TimeseriesStore()
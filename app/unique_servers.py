@@ -0,0 +1,113 @@
+import threading
+import time
+from datetime import timedelta
+from sqlalchemy import delete, func, select, update
+from app.aggregates import utc_now
+from app.database import db, insert_if_missing
+import config
+from utils.hll import HyperLogLog
+
+# One HyperLogLog sketch of the server_uids seen per handler per UTC day
+class ServerSketch(db.Model):
+    handler = db.Column(db.String(50), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    registers = db.Column(db.LargeBinary, nullable=False)
+    timestamp = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+# Periods reported, in days ending today
+PERIODS = {'day': 1, 'week': 7, 'month': 30}
+
+class UniqueServers:
+    def __init__(self, handler_name):
+        self.handler_name = handler_name
+        # Sketches not yet merged into the stored ones, by day
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def add(self, server_uids):
+        day = utc_now().date()
+        with self._lock:
+            sketch = self._pending.get(day)
+            if sketch is None:
+                sketch = self._pending[day] = HyperLogLog(config.UNIQUE_SERVERS_PRECISION)
+            for server_uid in server_uids:
+                sketch.add(server_uid)
+            due = time.monotonic() - self._last_flush >= config.UNIQUE_SERVERS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._last_flush = time.monotonic()
+            if not pending:
+                return
+
+            try:
+                for day, sketch in pending.items():
+                    self._merge_stored(day, sketch)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # Put them back for the next flush
+                with self._lock:
+                    for day, sketch in pending.items():
+                        self._pending[day] = sketch.merge(self._pending[day]) if day in self._pending else sketch
+                raise
+
+    def _merge_stored(self, day, sketch):
+        # Read, merge and write while holding the row, so two processes flushing the same day can't both
+        # read the old registers and have the last write drop what the other added. Inserting the row first
+        # takes SQLite's write lock for the rest of the transaction, other databases lock the row FOR UPDATE
+        key = {'handler': self.handler_name, 'day': day}
+        insert_if_missing(ServerSketch, dict(key, registers=HyperLogLog(sketch.precision).to_bytes()), ['handler', 'day'])
+        stored = db.session.execute(
+            select(ServerSketch.registers).where(
+                ServerSketch.handler == self.handler_name,
+                ServerSketch.day == day
+            ).with_for_update()
+        ).scalar_one()
+        merged = sketch.copy().merge(HyperLogLog.from_bytes(stored))
+        db.session.execute(
+            update(ServerSketch).where(
+                ServerSketch.handler == self.handler_name,
+                ServerSketch.day == day
+            ).values(registers=merged.to_bytes(), timestamp=func.now())
+        )
+
+    def counts(self):
+        today = utc_now().date()
+        since = today - timedelta(days=max(PERIODS.values()) - 1)
+        sketches = {
+            day: HyperLogLog.from_bytes(registers)
+            for day, registers in db.session.execute(
+                select(ServerSketch.day, ServerSketch.registers).where(
+                    ServerSketch.handler == self.handler_name,
+                    ServerSketch.day >= since
+                )
+            )
+        }
+        with self._lock:
+            for day, sketch in self._pending.items():
+                sketches[day] = sketch.copy().merge(sketches[day]) if day in sketches else sketch.copy()
+
+        counts = {}
+        for period, days in PERIODS.items():
+            merged = HyperLogLog(config.UNIQUE_SERVERS_PRECISION)
+            for day, sketch in sketches.items():
+                if (today - day).days < days:
+                    merged.merge(sketch)
+            counts[period] = merged.count()
+        return counts
+
+    def prune(self):
+        cutoff = utc_now().date() - timedelta(days=max(config.UNIQUE_SERVERS_RETENTION_DAYS, max(PERIODS.values())))
+        result = db.session.execute(delete(ServerSketch).where(
+            ServerSketch.handler == self.handler_name,
+            ServerSketch.day < cutoff
+        ))
+        db.session.commit()
+        return result.rowcount
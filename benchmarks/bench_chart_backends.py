@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+def sample_charts(version_count):
+    return [
+        {
+            'title': 'Server Type Distribution',
+            'labels': ['dedicated', 'listen', 'local'],
+            'sizes': [1200, 340, 25],
+            'chart_type': 'bar'
+        },
+        {
+            'title': 'Version Distribution',
+            'labels': [f'1.{i // 10}.{i % 10}' for i in range(version_count)],
+            'sizes': [(i * 37) % 500 + 1 for i in range(version_count)],
+            'chart_type': 'horizontal_bar'
+        }
+    ]
+
+def run_child(backend, version_count, repeat):
+    # Runs in a fresh interpreter so import cost and peak RSS belong to this backend alone
+    start = time.perf_counter()
+    # Not benchmarks.common, which would pull Flask and SQLAlchemy into the measured RSS
+    os.environ.setdefault('AUTH_TOKEN', 'benchmark')
+    os.environ.setdefault('WEBHOOK_URL', 'http://127.0.0.1:9/webhook')
+    import config
+    config.CHART_BACKEND = backend
+    from utils.chart_helper import render_charts
+
+    charts = sample_charts(version_count)
+    first_start = time.perf_counter()
+    image = render_charts(charts)
+    first = time.perf_counter() - first_start
+
+    timings = []
+    for _ in range(repeat):
+        render_start = time.perf_counter()
+        render_charts(charts)
+        timings.append(time.perf_counter() - render_start)
+
+    print(json.dumps({
+        'backend': backend,
+        'import_and_first_render': first_start - start + first,
+        'render': min(timings),
+        'png_bytes': len(image),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }))
+
+def run(backends, version_count, repeat):
+    print(f"{'backend':>12} {'cold (s)':>10} {'render (s)':>11} {'png (KB)':>9} {'peak RSS (MB)':>14}")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for backend in backends:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_chart_backends', '--child', backend,
+             '--versions', str(version_count), '--repeat', str(repeat)],
+            cwd=root, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{backend:>12} {result['import_and_first_render']:>10.3f} {result['render']:>11.4f} "
+              f"{result['png_bytes'] / 1024:>9.1f} {result['peak_rss_mb']:>14.1f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render time and peak memory of the chart backends")
+    parser.add_argument('--backends', nargs='+', default=['matplotlib', 'pillow'])
+    parser.add_argument('--versions', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args.child, args.versions, args.repeat)
+    else:
+        run(args.backends, args.versions, args.repeat)
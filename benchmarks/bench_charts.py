@@ -0,0 +1,38 @@
+import argparse
+from benchmarks.common import measure
+import config
+from utils.chart_helper import create_charts
+
+CHART_TYPES = ['pie', 'bar', 'horizontal_bar', 'box']
+
+def sample_chart(chart_type, label_count):
+    sizes = [(i * 37) % 500 + 1 for i in range(label_count)]
+    if chart_type == 'box':
+        sizes = [[size * 0.1, size * 0.4, size * 0.5, size * 0.7, size] for size in sizes]
+    return {
+        'title': f'{chart_type} benchmark',
+        'labels': [f'1.{i // 10}.{i % 10}' for i in range(label_count)],
+        'sizes': sizes,
+        'chart_type': chart_type
+    }
+
+def run(backends, label_counts, repeat):
+    # Cached renders would only time a dict lookup
+    config.CHART_CACHE_SIZE = 0
+    print(f"{'backend':>12} {'chart type':>15} {'labels':>7} {'seconds':>10}")
+    for backend in backends:
+        config.CHART_BACKEND = backend
+        for chart_type in CHART_TYPES:
+            for label_count in label_counts:
+                charts = [sample_chart(chart_type, label_count)]
+                create_charts(charts)
+                seconds = measure(lambda: create_charts(charts), repeat)
+                print(f"{backend:>12} {chart_type:>15} {label_count:>7} {seconds:>10.4f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="create_charts render time per chart type")
+    parser.add_argument('--backends', nargs='+', default=['matplotlib', 'pillow'])
+    parser.add_argument('--labels', type=int, nargs='+', default=[3, 40])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.backends, args.labels, args.repeat)
@@ -0,0 +1,164 @@
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from benchmarks.common import SERVER_TYPES, VERSIONS, create_benchmark_app, database_size, percentile
+from app.stats_manager import StatsManager
+import config
+
+class Fleet:
+    # A fixed population of game servers, each with its own handler, type and version like the real thing
+    def __init__(self, size, handlers, seed=0):
+        rng = random.Random(seed)
+        self.servers = [
+            (f'server-{i}', handlers[i % len(handlers)], rng.choice(SERVER_TYPES), rng.choice(VERSIONS))
+            for i in range(size)
+        ]
+
+    def payload(self, index, rng):
+        server_uid, handler_name, server_type, version = self.servers[index % len(self.servers)]
+        payload = {
+            'handler': handler_name,
+            'server_uid': server_uid,
+            'server_type': server_type,
+            'version': version,
+            'players': rng.randint(0, 64)
+        }
+        if handler_name.startswith('resource-gatherers'):
+            payload['gatherers'] = rng.randint(0, 500)
+        return payload
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.app = app
+
+    def connect(self):
+        client = self.app.test_client()
+
+        def send(body):
+            response = client.post('/submit', data=body, headers={
+                'Authorization': config.AUTH_TOKEN, 'Content-Type': 'application/json'
+            })
+            return response.status_code
+        return send
+
+    def close(self):
+        pass
+
+class WaitressTransport:
+    def __init__(self, app, threads):
+        from waitress import create_server
+        # Queue depth warnings are expected when the fleet outruns the threads, the latencies show it anyway
+        logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+        self.server = create_server(app, host='127.0.0.1', port=0, threads=threads)
+        self.port = self.server.effective_port
+        threading.Thread(target=self.server.run, daemon=True).start()
+
+    def connect(self):
+        connection = [http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)]
+
+        def send(body):
+            try:
+                connection[0].request('POST', '/submit', body, {
+                    'Authorization': config.AUTH_TOKEN, 'Content-Type': 'application/json'
+                })
+                response = connection[0].getresponse()
+                response.read()
+                return response.status
+            except (OSError, http.client.HTTPException):
+                connection[0].close()
+                connection[0] = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+                return None
+        return send
+
+    def close(self):
+        self.server.close()
+
+def simulate(transport, fleet, clients, duration, rate):
+    # Every client walks its own slice of the fleet; with a rate each one keeps to a fixed schedule,
+    # so a slow server shows up as latency instead of fewer requests
+    stop = threading.Event()
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    interval = clients / rate if rate else 0
+
+    def client(worker):
+        rng = random.Random(worker)
+        send = transport.connect()
+        index = worker
+        next_send = time.perf_counter()
+        local_latencies, local_statuses = [], {}
+        while not stop.is_set():
+            if interval:
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send += interval
+            body = json.dumps(fleet.payload(index, rng))
+            index += clients
+            start = time.perf_counter()
+            status = send(body)
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+# Where the per-server quantiles come from, which decides what every write has to keep up to date
+QUANTILE_MODES = {'live': True, 'stored': False}
+
+def run(fleet_sizes, handlers, transport_name, clients, duration, rate, buffered, threads, quantile_modes):
+    print(f"{'servers':>8} {'quantiles':>9} {'transport':>12} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'errors':>7} {'DB (MB)':>8}")
+    config.INGEST_BUFFER_ENABLED = buffered
+    for size in fleet_sizes:
+        for mode in quantile_modes:
+            config.LIVE_AGGREGATES_ENABLED = QUANTILE_MODES[mode]
+            StatsManager._instance = None
+            database_path = os.path.join(tempfile.mkdtemp(prefix='stats-bench-'), 'fleet.db')
+            app = create_benchmark_app(handlers, database_path)
+            manager = StatsManager._instance
+            if manager.ingest_buffer:
+                manager.ingest_buffer.start()
+
+            transport = WaitressTransport(app, threads) if transport_name == 'waitress' else TestClientTransport(app)
+            try:
+                latencies, statuses = simulate(transport, Fleet(size, handlers), clients, duration, rate)
+            finally:
+                transport.close()
+            if manager.ingest_buffer:
+                manager.ingest_buffer.flush()
+
+            errors = sum(count for status, count in statuses.items() if status != 200)
+            print(f"{size:>8} {mode:>9} {transport_name:>12} {len(latencies) / duration:>8.0f} "
+                  f"{percentile(latencies, 0.5) * 1000:>9.2f} {percentile(latencies, 0.95) * 1000:>9.2f} "
+                  f"{percentile(latencies, 0.99) * 1000:>9.2f} {errors:>7} {database_size(database_path) / 2**20:>8.1f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulated game server fleet submitting to /submit")
+    parser.add_argument('--servers', type=int, nargs='+', default=[10000, 100000], help="fleet sizes (distinct server_uids)")
+    parser.add_argument('--handlers', nargs='+', default=['resource-gatherers', 'resource-gatherers-custom', 'build-tools'])
+    parser.add_argument('--transport', choices=['test-client', 'waitress'], default='test-client')
+    parser.add_argument('--clients', type=int, default=16, help="concurrent connections")
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--rate', type=float, default=0, help="target requests per second across all clients, 0 for as fast as possible")
+    parser.add_argument('--buffered', action='store_true', help="go through the ingest buffer")
+    parser.add_argument('--threads', type=int, default=config.WEB_THREADS, help="waitress threads")
+    parser.add_argument('--quantiles', nargs='+', choices=list(QUANTILE_MODES), default=list(QUANTILE_MODES),
+                        help="live aggregates, or the histograms stored on every write that several workers need")
+    args = parser.parse_args()
+    run(args.servers, args.handlers, args.transport, args.clients, args.duration, args.rate, args.buffered, args.threads, args.quantiles)
@@ -0,0 +1,44 @@
+import argparse
+from benchmarks.common import QueryCounter, create_benchmark_app, measure, seed_rows
+from app.database import db
+from app.stats_manager import StatsManager
+from sqlalchemy import func
+
+# The original one-query-per-metric ResourceGatherersHandler.get_stats, kept for comparison
+def legacy_get_stats(model, highscore_model):
+    one_hour_ago = func.datetime('now', '-1 hour')
+    window = model.timestamp >= one_hour_ago
+    db.session.query(func.count(model.server_uid)).filter(window).scalar()
+    db.session.query(func.sum(model.gatherers)).filter(window).scalar()
+    db.session.query(func.sum(model.players)).filter(window).scalar()
+    db.session.query(model.server_type_id, func.count(model.server_uid)).filter(window).group_by(model.server_type_id).all()
+    db.session.query(model.version_id, func.count(model.server_uid)).filter(window).group_by(model.version_id).all()
+    db.session.query(func.max(model.gatherers)).filter(window).scalar()
+    db.session.query(highscore_model).order_by(highscore_model.timestamp.desc()).first()
+
+def run(row_counts, repeat):
+    from app.handlers.resource_gatherers import ResourceGatherersHighscores
+
+    print(f"{'rows':>10} {'variant':>8} {'queries':>8} {'seconds':>10}")
+    for rows in row_counts:
+        app = create_benchmark_app(['resource-gatherers'])
+        with app.app_context():
+            handler = StatsManager._instance.handlers['resource-gatherers']
+            seed_rows(handler, rows)
+
+            variants = {
+                'legacy': lambda: legacy_get_stats(handler.stats_model, ResourceGatherersHighscores),
+                'current': handler.get_stats
+            }
+            for name, func_ in variants.items():
+                with QueryCounter(db.engine) as counter:
+                    func_()
+                seconds = measure(func_, repeat)
+                print(f"{rows:>10} {name:>8} {counter.count:>8} {seconds:>10.4f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query count and wall time of get_stats")
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import random
+import time
+
+# Submissions only reach the buffer, so what is timed is parsing, validation and the response
+os.environ['INGEST_BUFFER_ENABLED'] = 'True'
+
+from benchmarks.common import create_benchmark_app, random_payload
+from app.stats_manager import StatsManager
+import config
+from utils import json_codec
+
+HANDLER = 'resource-gatherers'
+
+# The validation /submit did before payload schemas, kept for comparison
+def legacy_validate(data):
+    data.setdefault('version', '-1')
+    data.setdefault('players', 0)
+    missing = [field for field in ('server_uid', 'gatherers', 'server_type', 'version', 'players') if field not in data]
+    return f"Missing fields: {', '.join(missing)}" if missing else None
+
+def cpu_per_call(func, count):
+    # Best of three, in microseconds of process CPU time
+    best = None
+    for _ in range(3):
+        start = time.process_time()
+        for _ in range(count):
+            func()
+        elapsed = (time.process_time() - start) / count * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run(count):
+    app = create_benchmark_app([HANDLER])
+    handler = StatsManager._instance.handlers[HANDLER]
+    buffer = StatsManager._instance.ingest_buffer
+    buffer.max_size = count * 10
+
+    rng = random.Random(0)
+    payload = random_payload(HANDLER, 'server-0', rng)
+    body = json.dumps(payload).encode()
+    with app.app_context():
+        stats = handler.get_formatted_stats()
+
+    orjson = json_codec.orjson
+    codecs = {'json': None, 'orjson': orjson} if orjson is not None else {'json': None}
+
+    print(f"{'step':>22} {'codec':>8} {'us/call':>10}")
+    for name, module in codecs.items():
+        json_codec.orjson = module
+        print(f"{'decode heartbeat':>22} {name:>8} {cpu_per_call(lambda: json_codec.loads(body), count):>10.2f}")
+        print(f"{'encode /stats body':>22} {name:>8} {cpu_per_call(lambda: json_codec.dumps(stats, sort_keys=True), count // 10):>10.2f}")
+    json_codec.orjson = orjson
+
+    print(f"{'legacy validate':>22} {'-':>8} {cpu_per_call(lambda: legacy_validate(dict(payload)), count):>10.2f}")
+    print(f"{'schema validate':>22} {'-':>8} {cpu_per_call(lambda: handler.validate(payload), count):>10.2f}")
+
+    client = app.test_client()
+    headers = {'Authorization': config.AUTH_TOKEN, 'Content-Type': 'application/json'}
+
+    def submit():
+        response = client.post('/submit', data=body, headers=headers)
+        assert response.status_code == 200, response.get_data()
+
+    for name, module in codecs.items():
+        json_codec.orjson = module
+        print(f"{'POST /submit':>22} {name:>8} {cpu_per_call(submit, count // 10):>10.2f}")
+        # Nothing is meant to be written, just keep the buffer from filling up
+        buffer._pending.clear()
+    json_codec.orjson = orjson
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="CPU time per submission spent on JSON and validation")
+    parser.add_argument('--count', type=int, default=20000, help="calls per measurement")
+    args = parser.parse_args()
+    run(args.count)
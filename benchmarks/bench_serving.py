@@ -0,0 +1,115 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SERVERS = {
+    'dev': (['main.py'], {}),
+    'waitress': (['serve.py'], {'WEB_WORKERS': '1'}),
+    'gunicorn': (['serve.py'], {'WEB_WORKERS': '4'})
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+def load(port, clients, duration, servers):
+    stop = threading.Event()
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def client(worker):
+        rng = random.Random(worker)
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        while not stop.is_set():
+            body = json.dumps({
+                'handler': 'resource-gatherers',
+                'server_uid': f'server-{rng.randrange(servers)}',
+                'server_type': 'dedicated',
+                'version': '1.0.0',
+                'gatherers': rng.randint(0, 500),
+                'players': rng.randint(0, 64)
+            })
+            start = time.perf_counter()
+            try:
+                connection.request('POST', '/submit', body, {'Authorization': 'benchmark', 'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+                ok = False
+            with lock:
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors[0] += 1
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+def run(servers, clients, duration, fleet):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    print(f"{'server':>9} {'req/s':>8} {'p50 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+    for name in servers:
+        script, extra_env = SERVERS[name]
+        port = free_port()
+        env = dict(
+            os.environ,
+            **extra_env,
+            AUTH_TOKEN='benchmark',
+            WEBHOOK_URL='http://127.0.0.1:9/webhook',
+            HOST='127.0.0.1',
+            PORT=str(port),
+            SCHEDULER_MODE='separate',
+            DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='stats-bench-'), 'serving.db')}"
+        )
+        process = subprocess.Popen([sys.executable, *script], cwd=root, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(port)
+            latencies, errors = load(port, clients, duration, fleet)
+        finally:
+            process.terminate()
+            process.wait()
+        print(f"{name:>9} {len(latencies) / duration:>8.0f} {percentile(latencies, 0.5) * 1000:>9.2f} "
+              f"{percentile(latencies, 0.99) * 1000:>9.2f} {errors:>7}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="/submit throughput of the dev server against the production servers")
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--fleet', type=int, default=10000, help="distinct server_uids to submit for")
+    args = parser.parse_args()
+    run(args.servers, args.clients, args.duration, args.fleet)
@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+PROFILES = {
+    'default': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL'},
+    'wal': {'SQLITE_JOURNAL_MODE': 'WAL', 'SQLITE_SYNCHRONOUS': 'NORMAL'}
+}
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+def run_child(writers, readers, duration, rows, batch_size):
+    # Profiles are read from config at import time, so each one runs in its own interpreter
+    from benchmarks.common import create_benchmark_app, random_payload, seed_rows
+    from app.database import db
+    from app.stats_manager import StatsManager
+
+    app = create_benchmark_app(['resource-gatherers'])
+    handler = StatsManager._instance.handlers['resource-gatherers']
+    with app.app_context():
+        seed_rows(handler, rows)
+
+    stop = threading.Event()
+    results = {'writes': 0, 'write_errors': 0, 'read_latencies': [], 'read_errors': 0}
+    lock = threading.Lock()
+
+    def writer(worker):
+        sequence = 0
+        with app.app_context():
+            while not stop.is_set():
+                batch = [random_payload('resource-gatherers', f'server-{(worker * 7919 + sequence + i) % rows}') for i in range(batch_size)]
+                sequence += batch_size
+                try:
+                    handler.add_stats_batch(batch)
+                    db.session.commit()
+                    with lock:
+                        results['writes'] += len(batch)
+                except Exception:
+                    db.session.rollback()
+                    with lock:
+                        results['write_errors'] += 1
+
+    def reader():
+        with app.app_context():
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    handler.query_window_stats()
+                    db.session.commit()
+                    latency = time.perf_counter() - start
+                    with lock:
+                        results['read_latencies'].append(latency)
+                except Exception:
+                    db.session.rollback()
+                    with lock:
+                        results['read_errors'] += 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = results['read_latencies']
+    print(json.dumps({
+        'writes_per_second': results['writes'] / duration,
+        'write_errors': results['write_errors'],
+        'reads': len(latencies),
+        'read_p50': percentile(latencies, 0.5),
+        'read_p99': percentile(latencies, 0.99),
+        'read_max': max(latencies, default=0),
+        'read_errors': results['read_errors']
+    }))
+
+def run(profiles, writers, readers, duration, rows, batch_size):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    print(f"{'profile':>8} {'writes/s':>9} {'w err':>6} {'reads':>6} {'read p50':>9} {'read p99':>9} {'read max':>9} {'r err':>6}")
+    for name in profiles:
+        env = dict(os.environ, **PROFILES[name], LIVE_AGGREGATES_ENABLED='False', HIGHSCORES_ON_INGEST='False')
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_sqlite_concurrency', '--child',
+             '--writers', str(writers), '--readers', str(readers), '--duration', str(duration),
+             '--rows', str(rows), '--batch-size', str(batch_size)],
+            cwd=root, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads([line for line in output.splitlines() if line.startswith('{')][-1])
+        print(f"{name:>8} {result['writes_per_second']:>9.0f} {result['write_errors']:>6} {result['reads']:>6} "
+              f"{result['read_p50']:>9.4f} {result['read_p99']:>9.4f} {result['read_max']:>9.4f} {result['read_errors']:>6}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Concurrent writers and window readers under each SQLite profile")
+    parser.add_argument('--profiles', nargs='+', default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args.writers, args.readers, args.duration, args.rows, args.batch_size)
+    else:
+        run(args.profiles, args.writers, args.readers, args.duration, args.rows, args.batch_size)
@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+def run_child(result_path):
+    # Fresh interpreter, so every import below is paid for here
+    start = time.perf_counter()
+    import main
+    import config
+    imported = time.perf_counter()
+
+    app = main.create_app()
+    created = time.perf_counter()
+
+    client = app.test_client()
+    response = client.post('/submit', headers={'Authorization': config.AUTH_TOKEN}, json={
+        'handler': config.ENABLED_HANDLERS[0],
+        'server_uid': 'startup-benchmark',
+        'server_type': 'dedicated',
+        'gatherers': 1
+    })
+    submitted = time.perf_counter()
+
+    with open(result_path, 'w') as result_file:
+        json.dump({
+            'import': imported - start,
+            'create_app': created - imported,
+            'first_submit': submitted - start,
+            'status': response.status_code,
+            'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'matplotlib_loaded': 'matplotlib' in sys.modules,
+            'requests_loaded': 'requests' in sys.modules
+        }, result_file)
+
+def run(repeat):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    print(f"{'import (s)':>10} {'create_app (s)':>15} {'first /submit (s)':>18} {'RSS (MB)':>9} {'matplotlib':>11} {'requests':>9}")
+    for _ in range(repeat):
+        # Each run gets an empty database and a webhook that goes nowhere. The scheduler stays off,
+        # a web process that isn't the one scheduling starts the same way
+        directory = tempfile.mkdtemp(prefix='stats-bench-')
+        result_path = os.path.join(directory, 'result.json')
+        env = dict(
+            os.environ,
+            AUTH_TOKEN='benchmark',
+            WEBHOOK_URL='http://127.0.0.1:9/webhook',
+            DATABASE_URL=f"sqlite:///{os.path.join(directory, 'startup.db')}",
+            SCHEDULER_MODE='off'
+        )
+        subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_startup', '--child', result_path],
+            cwd=root, env=env, capture_output=True, check=True
+        )
+        # Written to a file, whatever the app prints on stdout can't get mixed in
+        with open(result_path) as result_file:
+            result = json.load(result_file)
+        print(f"{result['import']:>10.3f} {result['create_app']:>15.3f} {result['first_submit']:>18.3f} "
+              f"{result['rss_mb']:>9.1f} {str(result['matplotlib_loaded']):>11} {str(result['requests_loaded']):>9}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import time, time to first /submit and RSS of a cold start")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', metavar='RESULT_PATH', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args.child)
+    else:
+        run(args.repeat)
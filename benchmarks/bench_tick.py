@@ -0,0 +1,33 @@
+import argparse
+import time
+from benchmarks.common import create_benchmark_app, measure, seed_rows
+from app.stats_manager import StatsManager
+import config
+
+def run(row_counts, handlers, repeat):
+    # Reports pile up in the delivery queue, the worker that would post them is never started
+    config.CHART_CACHE_SIZE = 0
+    print(f"{'rows':>10} {'handlers':>9} {'first tick (s)':>15} {'tick (s)':>10}")
+    for rows in row_counts:
+        StatsManager._instance = None
+        app = create_benchmark_app(handlers)
+        manager = StatsManager._instance
+        with app.app_context():
+            for handler in manager.handlers.values():
+                seed_rows(handler, rows)
+                handler.rebuild_live_aggregate()
+                handler.load_highscores()
+
+        start = time.perf_counter()
+        manager.run_tick()
+        first = time.perf_counter() - start
+        seconds = measure(manager.run_tick, repeat)
+        print(f"{rows:>10} {len(handlers):>9} {first:>15.4f} {seconds:>10.4f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Wall time of one full scheduler tick")
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000], help="rows seeded per handler")
+    parser.add_argument('--handlers', nargs='+', default=['resource-gatherers', 'resource-gatherers-custom', 'build-tools'])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.rows, args.handlers, args.repeat)
@@ -0,0 +1,120 @@
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+# config.py refuses to import without these, benchmarks never talk to Discord
+os.environ.setdefault('AUTH_TOKEN', 'benchmark')
+os.environ.setdefault('WEBHOOK_URL', 'http://127.0.0.1:9/webhook')
+os.environ.setdefault('INGEST_BUFFER_ENABLED', 'False')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+from app.api import api_bp
+from app.database import db, init_database
+from app.handlers import load_handlers
+from app.stats_manager import StatsManager
+import config
+from utils.json_codec import JSONProvider
+
+SERVER_TYPES = ['dedicated', 'listen', 'local']
+VERSIONS = [f'1.{minor}.{patch}' for minor in range(5) for patch in range(4)]
+
+def create_benchmark_app(handlers, database_path=None):
+    if database_path is None:
+        database_path = os.path.join(tempfile.mkdtemp(prefix='stats-bench-'), 'bench.db')
+    config.ENABLED_HANDLERS = list(handlers)
+
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.json = JSONProvider(app)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database_path}'
+    load_handlers(config.ENABLED_HANDLERS)
+    init_database(app)
+    app.register_blueprint(api_bp)
+
+    # The scheduler is left stopped, benchmarks drive it by hand
+    StatsManager(app)
+    return app
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+def random_payload(handler_name, server_uid, rng=random):
+    payload = {
+        'handler': handler_name,
+        'server_uid': server_uid,
+        'server_type': rng.choice(SERVER_TYPES),
+        'version': rng.choice(VERSIONS),
+        'players': rng.randint(0, 64)
+    }
+    if handler_name.startswith('resource-gatherers'):
+        payload['gatherers'] = rng.randint(0, 500)
+    return payload
+
+def seed_rows(handler, count, window_fraction=0.8, seed=0, chunk_size=50000):
+    # window_fraction of the rows fall inside the last hour, the rest are stale
+    rng = random.Random(seed)
+    now = utc_now()
+    table = handler.stats_model.__table__
+    columns = set(table.columns.keys())
+    for start in range(0, count, chunk_size):
+        rows = []
+        for i in range(start, min(start + chunk_size, count)):
+            age = rng.uniform(0, 3600) if rng.random() < window_fraction else rng.uniform(3600, 86400 * 30)
+            row = random_payload('resource-gatherers', f'server-{i}', rng)
+            row['timestamp'] = now - timedelta(seconds=age)
+            rows.append(row)
+        label_ids = handler.intern_labels(rows)
+        rows = [
+            {key: value for key, value in handler.apply_label_ids(row, label_ids).items() if key in columns}
+            for row in rows
+        ]
+        db.session.execute(table.insert(), rows)
+        db.session.commit()
+    # Rows inserted directly skip the stored quantile histograms, count them the way startup does
+    if handler.quantile_histograms is not None:
+        handler.quantile_histograms.backfill()
+        db.session.commit()
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _before_cursor_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+
+@contextmanager
+def timer(results, key):
+    start = time.perf_counter()
+    yield
+    results[key] = time.perf_counter() - start
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+def database_size(database_path):
+    # WAL mode keeps recent writes in the -wal file until a checkpoint
+    return sum(os.path.getsize(path) for path in (database_path, database_path + '-wal') if os.path.exists(path))
+
+def measure(func, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
@@ -1,10 +1,23 @@
 import os
+from sqlalchemy.engine import make_url
 
 # Flask settings
 DEBUG = os.getenv('DEBUG', 'False') == 'True'
 HOST = os.getenv('HOST', '0.0.0.0')
 PORT = int(os.getenv('PORT', 46423))
 
+# Production server (serve.py), waitress threads in one process or gunicorn workers beyond that
+WEB_THREADS = int(os.getenv('WEB_THREADS', 8))
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 1))
+
+# Scheduler
+# 'embedded' runs it in the first web process to take the lock file, 'separate' leaves it
+# to scheduler.py, 'off' disables reporting
+SCHEDULER_MODE = os.getenv('SCHEDULER_MODE', 'embedded')
+SCHEDULER_LOCK_FILE = os.getenv('SCHEDULER_LOCK_FILE')
+# Web processes take turns creating and migrating tables on startup under this lock file
+SCHEMA_LOCK_FILE = os.getenv('SCHEMA_LOCK_FILE')
+
 # Authentication
 # Each request will require their auth token to match, otherwise no data will be added
 AUTH_TOKEN = os.getenv('AUTH_TOKEN')
@@ -15,14 +28,156 @@ if AUTH_TOKEN is None:
 SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///app.db')
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool, shared by request threads, the ingest buffer and the scheduler.
+# In-memory SQLite gets a single static connection instead, which takes no sizing options
+_database_url = make_url(SQLALCHEMY_DATABASE_URI)
+SQLALCHEMY_ENGINE_OPTIONS = {}
+if not (_database_url.get_backend_name() == 'sqlite' and _database_url.database in (None, '', ':memory:')):
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30))
+    }
+
+# SQLite storage profile, applied to every new connection
+# WAL lets readers carry on while a write is in progress, NORMAL only fsyncs at checkpoints
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)), # milliseconds
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -65536)), # negative values are KiB
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 268435456))
+}
+
+# Retention
+# Servers that haven't reported for this many days are deleted, 0 keeps them forever
+STATS_RETENTION_DAYS = int(os.getenv('STATS_RETENTION_DAYS', 30))
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 500))
+RETENTION_BATCH_PAUSE = float(os.getenv('RETENTION_BATCH_PAUSE', 0.05))
+# Seconds per tick spent deleting stale rows of each handler, after the report is sent
+RETENTION_MAX_SECONDS = float(os.getenv('RETENTION_MAX_SECONDS', 30))
+
+# Write-behind ingestion buffer
+# Submissions are coalesced per server_uid in memory and written in one transaction
+# once FLUSH_SIZE servers are pending or every FLUSH_INTERVAL seconds
+INGEST_BUFFER_ENABLED = os.getenv('INGEST_BUFFER_ENABLED', 'True') == 'True'
+INGEST_BUFFER_MAX_SIZE = int(os.getenv('INGEST_BUFFER_MAX_SIZE', 50000))
+INGEST_BUFFER_FLUSH_SIZE = int(os.getenv('INGEST_BUFFER_FLUSH_SIZE', 5000))
+INGEST_BUFFER_FLUSH_INTERVAL = float(os.getenv('INGEST_BUFFER_FLUSH_INTERVAL', 2))
+
+# Live aggregates
+# Keep the one-hour window stats in memory so /stats doesn't rescan the tables,
+# they are rebuilt from the database on startup and checked against it every interval.
+# Each process only sees its own writes, so unless this is set they are only used where the app is known
+# to be served by one process (serve.py with a single worker, python main.py) and samples and reports itself.
+# Under gunicorn they are always off, its workers can't be counted from inside one
+LIVE_AGGREGATES_ENABLED = os.getenv('LIVE_AGGREGATES_ENABLED', 'False') == 'True'
+# Differences from the database smaller than this fraction of a figure are taken as writes in flight, not drift
+LIVE_AGGREGATE_DRIFT_TOLERANCE = float(os.getenv('LIVE_AGGREGATE_DRIFT_TOLERANCE', 0.01))
+# Check highscores against the live aggregates on every write instead of only on each tick
+HIGHSCORES_ON_INGEST = os.getenv('HIGHSCORES_ON_INGEST', 'True') == 'True'
+# Seconds the best highscores are reused before being read again, they may be raised by another process
+HIGHSCORES_CACHE_TTL = float(os.getenv('HIGHSCORES_CACHE_TTL', 5))
+
+# Distributions
+# Server types and versions report the TOP_N most common labels and fold the rest into 'Other',
+# handlers can set their own limit per dimension. 0 reports every label
+DISTRIBUTION_TOP_N = int(os.getenv('DISTRIBUTION_TOP_N', 15))
+
+# Request limits
+# Bodies over MAX_CONTENT_LENGTH bytes are refused with 413 as they are read, single /submit bodies
+# over SUBMIT_MAX_BYTES before they are parsed, and batches holding more than SUBMIT_BATCH_MAX_RECORDS
+MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 4 * 1024 * 1024))
+SUBMIT_MAX_BYTES = int(os.getenv('SUBMIT_MAX_BYTES', 16 * 1024))
+SUBMIT_BATCH_MAX_RECORDS = int(os.getenv('SUBMIT_BATCH_MAX_RECORDS', 10000))
+
+# /stats response cache
+# Rendered responses are reused for TTL seconds, and dropped early on new writes if enabled
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', 5))
+STATS_CACHE_INVALIDATE_ON_WRITE = os.getenv('STATS_CACHE_INVALIDATE_ON_WRITE', 'True') == 'True'
+
 # Discord Webhook
 WEBHOOK_URL = os.getenv('WEBHOOK_URL')
 if WEBHOOK_URL is None:
     raise ValueError("WEBHOOK_URL environment variable is not set")
 
+# Webhook delivery
+# Reports wait in a bounded queue and are retried with exponential backoff,
+# honouring Discord's rate limit headers
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 100))
+WEBHOOK_TIMEOUT = float(os.getenv('WEBHOOK_TIMEOUT', 10))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 5))
+WEBHOOK_BACKOFF_BASE = float(os.getenv('WEBHOOK_BACKOFF_BASE', 1))
+WEBHOOK_BACKOFF_MAX = float(os.getenv('WEBHOOK_BACKOFF_MAX', 60))
+# Upload size per message, reports with more chart data than this are split
+WEBHOOK_MAX_UPLOAD_BYTES = int(os.getenv('WEBHOOK_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+
 # Stats collection interval (in seconds)
 STATS_INTERVAL = int(os.getenv('STATS_INTERVAL', 3600)) # 3600 = 1 hour
 
+# /stats can answer from the last tick's snapshot while it is younger than this many seconds.
+# Off by default: only the scheduler process has snapshots, so other workers would disagree with it,
+# and /stats stays as fresh as the live aggregates and the response cache make it
+STATS_SNAPSHOT_MAX_AGE = int(os.getenv('STATS_SNAPSHOT_MAX_AGE', 0))
+
+# Handler work is spread over this many threads, and a handler that takes
+# longer than HANDLER_TIMEOUT seconds is left out of the report
+STATS_WORKERS = int(os.getenv('STATS_WORKERS', 4))
+HANDLER_TIMEOUT = float(os.getenv('HANDLER_TIMEOUT', 60))
+
+# Quantiles
+# p50/p90/p99 of per-server values, each server counted once. Live aggregates hold the exact values,
+# otherwise they come from histograms stored per BUCKET_SECONDS of time, accurate to about RELATIVE_ACCURACY.
+# Only processes without live aggregates keep the histograms, the first to start fills them from existing rows
+# in batches of SCAN_BATCH_SIZE
+QUANTILE_RELATIVE_ACCURACY = float(os.getenv('QUANTILE_RELATIVE_ACCURACY', 0.01))
+QUANTILE_BUCKET_SECONDS = int(os.getenv('QUANTILE_BUCKET_SECONDS', 300))
+QUANTILE_SCAN_BATCH_SIZE = int(os.getenv('QUANTILE_SCAN_BATCH_SIZE', 5000))
+
+# Unique servers
+# Distinct server_uids per day are counted with HyperLogLog sketches of 2 ** PRECISION bytes each
+# (about 1.6% error at 12), merged into the stored sketches every FLUSH_INTERVAL seconds
+UNIQUE_SERVERS_ENABLED = os.getenv('UNIQUE_SERVERS_ENABLED', 'True') == 'True'
+UNIQUE_SERVERS_PRECISION = int(os.getenv('UNIQUE_SERVERS_PRECISION', 12))
+UNIQUE_SERVERS_FLUSH_INTERVAL = float(os.getenv('UNIQUE_SERVERS_FLUSH_INTERVAL', 60))
+UNIQUE_SERVERS_RETENTION_DAYS = int(os.getenv('UNIQUE_SERVERS_RETENTION_DAYS', 35))
+
+# Time series
+# Every TIMESERIES_INTERVAL seconds the one-hour window of each handler is stored as a minute bucket,
+# and folded into an hourly bucket holding the peaks. Minute buckets answer windows up to
+# MAX_MINUTE_BUCKETS minutes, hourly ones everything longer.
+# Heartbeats are counted per minute as they arrive, each process stores its counts every ACTIVITY_FLUSH_INTERVAL seconds
+TIMESERIES_ENABLED = os.getenv('TIMESERIES_ENABLED', 'True') == 'True'
+TIMESERIES_INTERVAL = int(os.getenv('TIMESERIES_INTERVAL', 60))
+TIMESERIES_ACTIVITY_FLUSH_INTERVAL = float(os.getenv('TIMESERIES_ACTIVITY_FLUSH_INTERVAL', 10))
+TIMESERIES_MAX_MINUTE_BUCKETS = int(os.getenv('TIMESERIES_MAX_MINUTE_BUCKETS', 360))
+TIMESERIES_MINUTE_RETENTION_HOURS = int(os.getenv('TIMESERIES_MINUTE_RETENTION_HOURS', 48))
+TIMESERIES_HOUR_RETENTION_DAYS = int(os.getenv('TIMESERIES_HOUR_RETENTION_DAYS', 90))
+TIMESERIES_MAX_POINTS = int(os.getenv('TIMESERIES_MAX_POINTS', 1000))
+
+# Charts are rendered in this many worker processes, 0 renders on the scheduler thread
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', 1))
+CHART_RENDER_TIMEOUT = float(os.getenv('CHART_RENDER_TIMEOUT', 120))
+# 'matplotlib' draws everything, 'pillow' draws bar charts with much less memory and falls back to matplotlib
+CHART_BACKEND = os.getenv('CHART_BACKEND', 'matplotlib')
+# Rendered images kept for chart inputs that haven't changed since an earlier tick, 0 disables
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', 32))
+
+# Metrics
+# /metrics serves request, database, chart, webhook and scheduler timings in the Prometheus text format.
+# Every process keeps its own, so scrape each worker when running several
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+# Scrapers that can't send the raw AUTH_TOKEN header can be let in without it
+METRICS_REQUIRE_AUTH = os.getenv('METRICS_REQUIRE_AUTH', 'True') == 'True'
+
+# SQL profiler
+# Off by default. Records every statement's fingerprint, calls, time and rows per handler method,
+# keeps the query plan of statements slower than SLOW_THRESHOLD seconds, and serves it all on /debug/queries
+QUERY_PROFILER_ENABLED = os.getenv('QUERY_PROFILER_ENABLED', 'False') == 'True'
+QUERY_PROFILER_SLOW_THRESHOLD = float(os.getenv('QUERY_PROFILER_SLOW_THRESHOLD', 0.1))
+QUERY_PROFILER_MAX_STATEMENTS = int(os.getenv('QUERY_PROFILER_MAX_STATEMENTS', 1000))
+QUERY_PROFILER_SLOW_LOG_SIZE = int(os.getenv('QUERY_PROFILER_SLOW_LOG_SIZE', 200))
+
 # Handlers
 ENABLED_HANDLERS = [
     
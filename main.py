@@ -1,32 +1,49 @@
+import os
+import sys
 from flask import Flask
 from flask_cors import CORS
 from app.api import api_bp
-from app.database import db
+from app.database import init_database
+from app.handlers import load_handlers
+from app.scheduler import should_run_scheduler
 from app.stats_manager import StatsManager
 import config
+from utils.json_codec import JSONProvider
 
-app = Flask(__name__)
+def configure_live_aggregates(single_process):
+    if single_process and 'LIVE_AGGREGATES_ENABLED' not in os.environ:
+        config.LIVE_AGGREGATES_ENABLED = config.SCHEDULER_MODE != 'separate'
+    if config.LIVE_AGGREGATES_ENABLED and 'gunicorn' in sys.modules:
+        print("Live aggregates are off under gunicorn, each worker would only count its own writes")
+        config.LIVE_AGGREGATES_ENABLED = False
 
-def create_app():
+# single_process is for callers that know nothing else serves this database, like serve.py's waitress
+def create_app(run_scheduler=None, single_process=False):
+    configure_live_aggregates(single_process)
+
+    app = Flask(__name__)
     app.config.from_object(config)
+    app.json = JSONProvider(app)
 
     CORS(app)
 
-    # Initialize extensions
-    db.init_app(app)
+    # Only enabled handlers' models exist for create_all to see
+    load_handlers(config.ENABLED_HANDLERS)
 
-    with app.app_context():
-        db.create_all()
+    # Initialize extensions
+    init_database(app)
 
     # Register blueprints
     app.register_blueprint(api_bp)
 
     # Initialize StatsManager
+    if run_scheduler is None:
+        run_scheduler = should_run_scheduler()
     stats_manager = StatsManager(app)
-    stats_manager.start()
+    stats_manager.start(run_scheduler)
 
     return app
 
 if __name__ == '__main__':
-    app = create_app()
-    app.run(host=config.HOST, port=config.PORT, debug=config.DEBUG)
\ No newline at end of file
+    app = create_app(single_process=True)
+    app.run(host=config.HOST, port=config.PORT, debug=config.DEBUG)
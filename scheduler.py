@@ -0,0 +1,11 @@
+import time
+import config
+from main import create_app
+
+# Runs the stats scheduler on its own, for SCHEDULER_MODE=separate deployments
+if __name__ == '__main__':
+    # Nothing is submitted to this process, so its window stats have to come from the database
+    config.LIVE_AGGREGATES_ENABLED = False
+    create_app(run_scheduler=True)
+    while True:
+        time.sleep(3600)
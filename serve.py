@@ -0,0 +1,23 @@
+import os
+import sys
+import config
+
+def main():
+    bind = f"{config.HOST}:{config.PORT}"
+    if config.WEB_WORKERS > 1:
+        # Several processes need gunicorn, each worker builds its own app and one of them schedules
+        os.execvp('gunicorn', [
+            'gunicorn',
+            '--bind', bind,
+            '--workers', str(config.WEB_WORKERS),
+            '--threads', str(config.WEB_THREADS),
+            'main:create_app()'
+        ])
+
+    from waitress import serve
+    from main import create_app
+    print(f"Serving on {bind} with {config.WEB_THREADS} threads")
+    serve(create_app(single_process=True), host=config.HOST, port=config.PORT, threads=config.WEB_THREADS)
+
+if __name__ == '__main__':
+    sys.exit(main())
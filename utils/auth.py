@@ -1,12 +1,18 @@
 from functools import wraps
 from flask import request, jsonify
 import config
+from utils.metrics import registry
+
+auth_failures = registry.counter(
+    'stats_auth_failures_total', 'Requests turned away by require_auth', ('route', 'reason')
+)
 
 def require_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         auth_token = request.headers.get('Authorization')
         if auth_token != config.AUTH_TOKEN:
+            auth_failures.inc(request.url_rule.rule, 'missing' if auth_token is None else 'invalid')
             return jsonify({'error': 'Unauthorized'}), 401
         return f(*args, **kwargs)
     return decorated
\ No newline at end of file
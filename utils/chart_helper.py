@@ -1,14 +1,46 @@
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import hashlib
 import io
-import base64
+import json
+import multiprocessing
+import threading
+from collections import OrderedDict
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+import config
+from utils.metrics import registry
+
+_executor = None
+
+# Rendered PNGs by chart spec hash, least recently used first
+_render_cache = OrderedDict()
+_render_cache_lock = threading.Lock()
+
+# Measured from this process, so it includes waiting for a free chart worker
+render_seconds = registry.histogram(
+    'stats_chart_render_duration_seconds', 'Time to render a handler\'s charts, cache misses only', ('backend',)
+)
+cache_lookups = registry.counter(
+    'stats_chart_cache_lookups_total', 'Chart renders looked up in the render cache, by result', ('result',)
+)
+registry.gauge('stats_chart_cache_size', 'Rendered chart images held in the render cache', lambda: len(_render_cache))
+
+def render_charts(charts_data):
+    # The Pillow backend only draws bar charts, anything else falls back to matplotlib
+    if config.CHART_BACKEND == 'pillow':
+        from utils import chart_pillow
+        if all(chart['chart_type'] in chart_pillow.SUPPORTED_CHART_TYPES for chart in charts_data):
+            return chart_pillow.render_charts(charts_data)
+    return render_charts_matplotlib(charts_data)
+
+def render_charts_matplotlib(charts_data):
+    # Imported here so a Pillow-only worker never loads matplotlib
+    from matplotlib.figure import Figure
 
-def create_charts(charts_data):
     num_charts = len(charts_data)
-    
-    fig, axs = plt.subplots(1, num_charts, figsize=(10*num_charts, 7), squeeze=False)
-    axs = axs[0]
+
+    # A standalone Figure keeps no pyplot global state, so renders can't interfere with each other
+    fig = Figure(figsize=(10*num_charts, 7))
+    axs = fig.subplots(1, num_charts, squeeze=False)[0]
     
     for i, chart_data in enumerate(charts_data):
         ax = axs[i]
@@ -42,21 +74,110 @@ def create_charts(charts_data):
                 ax.text(width, bar.get_y() + bar.get_height()/2.,
                         f'{width:,.0f}',
                         ha='left', va='center')
+        elif chart_data['chart_type'] == 'box':
+            # sizes are [low whisker, lower quartile, median, upper quartile, high whisker] per label,
+            # already summarised, so the boxes are drawn from the numbers rather than raw samples
+            boxes = [
+                {'label': label, 'whislo': low, 'q1': q1, 'med': median, 'q3': q3, 'whishi': high, 'fliers': []}
+                for label, (low, q1, median, q3, high) in zip(chart_data['labels'], chart_data['sizes'])
+            ]
+            ax.bxp(boxes, showfliers=False)
+            ax.set_ylabel('Value')
+            # Labels
+            for i, box in enumerate(boxes, start=1):
+                ax.text(i + 0.3, box['med'], f"{box['med']:,.0f}", ha='left', va='center')
         else:
             raise ValueError(f"Unsupported chart type: {chart_data['chart_type']}")
         
         ax.set_title(chart_data['title'])
     
-    plt.tight_layout()
+    fig.tight_layout()
     
-    # Save the plot to a bytes buffer
+    # Raw PNG bytes go straight into the webhook upload
     buffer = io.BytesIO()
-    plt.savefig(buffer, format='png', dpi=100)
-    buffer.seek(0)
-    
-    # Encode the image to base64
-    image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    
-    plt.close(fig)
-    
-    return f"data:image/png;base64,{image_base64}"
\ No newline at end of file
+    fig.savefig(buffer, format='png', dpi=100)
+    return buffer.getvalue()
+
+def _warm_up():
+    # Pay for the backend imports in the worker before the first tick needs them
+    if config.CHART_BACKEND == 'pillow':
+        from utils import chart_pillow  # noqa: F401
+    else:
+        from matplotlib.figure import Figure  # noqa: F401
+    return True
+
+def start_chart_pool():
+    global _executor
+    if _executor is not None or config.CHART_WORKERS <= 0:
+        return
+    # spawn rather than fork, the parent is multi-threaded by the time charts are drawn
+    _executor = ProcessPoolExecutor(
+        max_workers=config.CHART_WORKERS,
+        mp_context=multiprocessing.get_context('spawn')
+    )
+    # Start the workers now so the first tick doesn't pay for process startup and imports,
+    # without making startup wait for them
+    for _ in range(config.CHART_WORKERS):
+        _executor.submit(_warm_up)
+
+def _normalise_size(size):
+    # Box charts carry a five-number summary per label instead of a single value
+    if isinstance(size, (list, tuple)):
+        return [float(value) for value in size]
+    return float(size)
+
+def chart_cache_key(charts_data):
+    # Only what ends up in the image counts, labels and sizes are normalised so 3 and 3.0 hash alike
+    spec = [
+        [chart['chart_type'], chart['title'], [str(label) for label in chart['labels']], [_normalise_size(size) for size in chart['sizes']]]
+        for chart in charts_data
+    ]
+    return hashlib.sha256(json.dumps(spec, separators=(',', ':')).encode()).hexdigest()
+
+def _store_render(key, future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    with _render_cache_lock:
+        _render_cache[key] = future.result()
+        _render_cache.move_to_end(key)
+        while len(_render_cache) > config.CHART_CACHE_SIZE:
+            _render_cache.popitem(last=False)
+
+def _submit_render(charts_data):
+    future = Future()
+    if _executor is not None:
+        try:
+            return _executor.submit(render_charts, charts_data)
+        except RuntimeError as e:
+            # The pool shuts down with the interpreter, a tick still running then goes without charts
+            future.set_exception(e)
+            return future
+
+    try:
+        future.set_result(render_charts(charts_data))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def submit_charts(charts_data):
+    key = chart_cache_key(charts_data)
+    with _render_cache_lock:
+        image = _render_cache.get(key)
+        if image is not None:
+            _render_cache.move_to_end(key)
+    cache_lookups.inc('hit' if image is not None else 'miss')
+
+    if image is not None:
+        future = Future()
+        future.set_result(image)
+        return future
+
+    start = time.perf_counter()
+    future = _submit_render(charts_data)
+    future.add_done_callback(lambda done: render_seconds.observe(time.perf_counter() - start, config.CHART_BACKEND))
+    if config.CHART_CACHE_SIZE > 0:
+        future.add_done_callback(lambda done: _store_render(key, done))
+    return future
+
+def create_charts(charts_data):
+    return submit_charts(charts_data).result(timeout=config.CHART_RENDER_TIMEOUT)
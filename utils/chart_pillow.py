@@ -0,0 +1,173 @@
+import io
+import math
+from PIL import Image, ImageDraw, ImageFont
+
+# Bar charts drawn straight onto a Pillow canvas, sized like the 10x7 inch, 100 dpi matplotlib panels
+SUPPORTED_CHART_TYPES = ('bar', 'horizontal_bar', 'box')
+
+PANEL_WIDTH = 1000
+PANEL_HEIGHT = 700
+BAR_COLOUR = (31, 119, 180)
+TEXT_COLOUR = (0, 0, 0)
+AXIS_COLOUR = (0, 0, 0)
+GRID_TICKS = 6
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow without FreeType only has the fixed size bitmap font
+        return ImageFont.load_default()
+
+def _text_size(draw, text, font):
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    return right - left, bottom - top
+
+def _nice_ticks(maximum):
+    if maximum <= 0:
+        return [0, 1]
+    raw_step = maximum / (GRID_TICKS - 1)
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(factor * magnitude for factor in (1, 2, 2.5, 5, 10) if factor * magnitude >= raw_step)
+    return [step * i for i in range(math.ceil(maximum / step) + 1)]
+
+def _format_tick(value):
+    return f'{value:,.0f}' if float(value).is_integer() else f'{value:,.2f}'
+
+def _draw_title(draw, chart_data, fonts):
+    width, _ = _text_size(draw, chart_data['title'], fonts['title'])
+    draw.text(((PANEL_WIDTH - width) / 2, 12), chart_data['title'], font=fonts['title'], fill=TEXT_COLOUR)
+
+def _draw_bar(panel, chart_data, fonts):
+    draw = ImageDraw.Draw(panel)
+    labels = [str(label) for label in chart_data['labels']]
+    sizes = chart_data['sizes']
+    ticks = _nice_ticks(max(sizes, default=0))
+
+    label_height = max((_text_size(draw, label, fonts['label'])[0] for label in labels), default=0) * 0.72
+    left, top, right, bottom = 80, 50, PANEL_WIDTH - 20, PANEL_HEIGHT - 20 - int(label_height)
+    scale = (bottom - top) / ticks[-1]
+
+    for tick in ticks:
+        y = bottom - tick * scale
+        text = _format_tick(tick)
+        width, height = _text_size(draw, text, fonts['label'])
+        draw.line([(left - 5, y), (left, y)], fill=AXIS_COLOUR)
+        draw.text((left - 8 - width, y - height / 2 - 2), text, font=fonts['label'], fill=TEXT_COLOUR)
+    draw.line([(left, top), (left, bottom), (right, bottom)], fill=AXIS_COLOUR)
+
+    slot = (right - left) / max(len(sizes), 1)
+    for i, (label, size) in enumerate(zip(labels, sizes)):
+        x0 = left + slot * i + slot * 0.1
+        x1 = left + slot * (i + 1) - slot * 0.1
+        y = bottom - size * scale
+        draw.rectangle([x0, y, x1, bottom], fill=BAR_COLOUR)
+
+        value = f'{size:,.0f}'
+        width, height = _text_size(draw, value, fonts['label'])
+        draw.text(((x0 + x1 - width) / 2, y - height - 6), value, font=fonts['label'], fill=TEXT_COLOUR)
+
+        # Rotated 45 degrees and right-aligned under the bar, like the matplotlib version
+        width, height = _text_size(draw, label, fonts['label'])
+        text = Image.new('RGBA', (width + 4, height + 8), (255, 255, 255, 0))
+        ImageDraw.Draw(text).text((2, 0), label, font=fonts['label'], fill=TEXT_COLOUR)
+        text = text.rotate(45, expand=True, resample=Image.BICUBIC)
+        centre = (x0 + x1) / 2
+        panel.paste(text, (int(centre - text.width), int(bottom + 6)), text)
+
+    draw.text((10, top - 30), 'Value', font=fonts['label'], fill=TEXT_COLOUR)
+
+def _draw_horizontal_bar(panel, chart_data, fonts):
+    draw = ImageDraw.Draw(panel)
+    labels = [str(label) for label in chart_data['labels']]
+    sizes = chart_data['sizes']
+    ticks = _nice_ticks(max(sizes, default=0))
+
+    label_width = max((_text_size(draw, label, fonts['label'])[0] for label in labels), default=0)
+    left, top, right, bottom = 20 + label_width, 50, PANEL_WIDTH - 70, PANEL_HEIGHT - 50
+    scale = (right - left) / ticks[-1]
+
+    for tick in ticks:
+        x = left + tick * scale
+        text = _format_tick(tick)
+        width, _ = _text_size(draw, text, fonts['label'])
+        draw.line([(x, bottom), (x, bottom + 5)], fill=AXIS_COLOUR)
+        draw.text((x - width / 2, bottom + 8), text, font=fonts['label'], fill=TEXT_COLOUR)
+    draw.line([(left, top), (left, bottom), (right, bottom)], fill=AXIS_COLOUR)
+
+    width, _ = _text_size(draw, 'Value', fonts['label'])
+    draw.text(((left + right - width) / 2, bottom + 28), 'Value', font=fonts['label'], fill=TEXT_COLOUR)
+
+    # First label at the bottom, as barh draws them
+    slot = (bottom - top) / max(len(sizes), 1)
+    for i, (label, size) in enumerate(zip(labels, sizes)):
+        y1 = bottom - slot * i - slot * 0.1
+        y0 = bottom - slot * (i + 1) + slot * 0.1
+        x = left + size * scale
+        draw.rectangle([left, y0, x, y1], fill=BAR_COLOUR)
+
+        centre = (y0 + y1) / 2
+        width, height = _text_size(draw, label, fonts['label'])
+        draw.text((left - 8 - width, centre - height / 2 - 2), label, font=fonts['label'], fill=TEXT_COLOUR)
+        value = f'{size:,.0f}'
+        _, height = _text_size(draw, value, fonts['label'])
+        draw.text((x + 4, centre - height / 2 - 2), value, font=fonts['label'], fill=TEXT_COLOUR)
+
+def _draw_box(panel, chart_data, fonts):
+    draw = ImageDraw.Draw(panel)
+    labels = [str(label) for label in chart_data['labels']]
+    boxes = chart_data['sizes']
+    ticks = _nice_ticks(max((box[-1] for box in boxes), default=0))
+
+    left, top, right, bottom = 80, 50, PANEL_WIDTH - 20, PANEL_HEIGHT - 50
+    scale = (bottom - top) / ticks[-1]
+
+    for tick in ticks:
+        y = bottom - tick * scale
+        text = _format_tick(tick)
+        width, height = _text_size(draw, text, fonts['label'])
+        draw.line([(left - 5, y), (left, y)], fill=AXIS_COLOUR)
+        draw.text((left - 8 - width, y - height / 2 - 2), text, font=fonts['label'], fill=TEXT_COLOUR)
+    draw.line([(left, top), (left, bottom), (right, bottom)], fill=AXIS_COLOUR)
+
+    # Each box is [low whisker, lower quartile, median, upper quartile, high whisker]
+    slot = (right - left) / max(len(boxes), 1)
+    for i, (label, (low, q1, median, q3, high)) in enumerate(zip(labels, boxes)):
+        centre = left + slot * (i + 0.5)
+        half = slot * 0.2
+        draw.line([(centre, bottom - high * scale), (centre, bottom - q3 * scale)], fill=AXIS_COLOUR)
+        draw.line([(centre, bottom - q1 * scale), (centre, bottom - low * scale)], fill=AXIS_COLOUR)
+        for value in (low, high):
+            draw.line([(centre - half / 2, bottom - value * scale), (centre + half / 2, bottom - value * scale)], fill=AXIS_COLOUR)
+        draw.rectangle([centre - half, bottom - q3 * scale, centre + half, bottom - q1 * scale], outline=BAR_COLOUR, width=2)
+        y = bottom - median * scale
+        draw.line([(centre - half, y), (centre + half, y)], fill=(255, 127, 14), width=2)
+
+        value = f'{median:,.0f}'
+        _, height = _text_size(draw, value, fonts['label'])
+        draw.text((centre + half + 6, y - height / 2 - 2), value, font=fonts['label'], fill=TEXT_COLOUR)
+        width, _ = _text_size(draw, label, fonts['label'])
+        draw.text((centre - width / 2, bottom + 8), label, font=fonts['label'], fill=TEXT_COLOUR)
+
+    draw.text((10, top - 30), 'Value', font=fonts['label'], fill=TEXT_COLOUR)
+
+def render_charts(charts_data):
+    fonts = {'title': _font(18), 'label': _font(12)}
+    image = Image.new('RGB', (PANEL_WIDTH * len(charts_data), PANEL_HEIGHT), (255, 255, 255))
+
+    for i, chart_data in enumerate(charts_data):
+        panel = Image.new('RGB', (PANEL_WIDTH, PANEL_HEIGHT), (255, 255, 255))
+        if chart_data['chart_type'] == 'bar':
+            _draw_bar(panel, chart_data, fonts)
+        elif chart_data['chart_type'] == 'horizontal_bar':
+            _draw_horizontal_bar(panel, chart_data, fonts)
+        elif chart_data['chart_type'] == 'box':
+            _draw_box(panel, chart_data, fonts)
+        else:
+            raise ValueError(f"Unsupported chart type: {chart_data['chart_type']}")
+        _draw_title(ImageDraw.Draw(panel), chart_data, fonts)
+        image.paste(panel, (PANEL_WIDTH * i, 0))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=False)
+    return buffer.getvalue()
@@ -0,0 +1,56 @@
+import hashlib
+import math
+
+# 2 ** -rank for every rank a 64-bit hash can produce, so estimating is one lookup per register
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+
+class HyperLogLog:
+    # Distinct-count sketch in 2 ** precision one-byte registers (4 KiB at the default 12),
+    # about 1.04 / sqrt(2 ** precision) relative error, 1.6% at 12. Merging is a register-wise max,
+    # so sketches built in different processes or periods combine without double counting
+    def __init__(self, precision=12, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError(f"Unsupported HyperLogLog precision: {precision}")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError(f"Expected {self.size} registers, got {len(self.registers)}")
+
+    def add(self, value):
+        if isinstance(value, str):
+            value = value.encode()
+        hashed = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def copy(self):
+        return HyperLogLog(self.precision, self.registers)
+
+    def count(self):
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(_INVERSE_POWERS[rank] for rank in self.registers)
+        # Linear counting is more accurate while many registers are still empty
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data[0], data[1:])
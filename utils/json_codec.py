@@ -0,0 +1,40 @@
+import json
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Same output for either codec: compact separators, and anything orjson doesn't know natively
+# (including dates, kept as HTTP dates like Flask does) goes through Flask's default
+_OPTIONS = 0
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+def dumps(obj, sort_keys=False):
+    # Returns bytes, ready to be sent or cached
+    if orjson is not None:
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=_OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0))
+    return json.dumps(obj, default=DefaultJSONProvider.default, sort_keys=sort_keys, separators=(',', ':')).encode()
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Parses request bodies and renders jsonify responses with orjson when it is installed
+class JSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if orjson is None or set(kwargs) - {'sort_keys'}:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, kwargs.get('sort_keys', self.sort_keys)).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj, self.sort_keys), mimetype=self.mimetype)
@@ -0,0 +1,209 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+# Seconds, from a fast SQLite lookup up to a Discord upload that is about to time out
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# (handler, method) the current thread is working for, so database time can be attributed to it
+current_operation = ContextVar('current_operation', default=('-', '-'))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._create_lock = threading.Lock()
+
+    def labels(self, *values):
+        # Plain dict read on the hot path, the lock is only taken the first time a label set is seen
+        series = self._series.get(values)
+        if series is None:
+            with self._create_lock:
+                series = self._series.setdefault(values, self._new_series())
+        return series
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, series in sorted(self._series.items()):
+            lines.extend(self._render_series(values, series))
+        return lines
+
+class _CounterSeries:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def inc(self, *values, amount=1):
+        self.labels(*values).inc(amount)
+
+    def _render_series(self, values, series):
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {series.value}']
+
+class _HistogramSeries:
+    __slots__ = ('bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One slot per bucket plus +Inf, allocated once so observing never grows anything
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def read(self):
+        with self.lock:
+            return list(self.counts), self.sum
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self):
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value, *values):
+        self.labels(*values).observe(value)
+
+    @contextmanager
+    def time(self, *values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.labels(*values).observe(time.perf_counter() - start)
+
+    def _render_series(self, values, series):
+        counts, total = series.read()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, [('le', bound)])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {total}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+class Gauge(_Metric):
+    # Read when scraped, from a callback returning a number or a {label values: number} dict
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def render(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        for values, sample in sorted(value.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, values)} {sample}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        # Modules may be imported more than once (benchmarks, tests), the first registration wins
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        metric = Gauge(name, documentation, callback, labelnames)
+        # Callbacks close over live objects, so a newer one replaces the old
+        self._metrics[name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+db_query_seconds = registry.histogram(
+    'stats_db_query_duration_seconds', 'Time spent in database statements, by handler method', ('handler', 'method')
+)
+
+@contextmanager
+def operation(handler_name, method):
+    token = current_operation.set((handler_name, method))
+    try:
+        yield
+    finally:
+        current_operation.reset(token)
+
+def instrumented(method):
+    # The innermost instrumented method a statement runs under is the one it is charged to
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with operation(self.name, method.__name__):
+            return method(self, *args, **kwargs)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    db_query_seconds.observe(elapsed, *current_operation.get())
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute, drop its start time
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start'):
+        connection.info['query_start'].pop()
+
+def instrument_engine(engine):
+    from sqlalchemy import event
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
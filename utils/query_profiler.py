@@ -0,0 +1,151 @@
+import re
+import threading
+import time
+from collections import deque
+from utils.metrics import current_operation
+import config
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAMETER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_ROW_LIST = re.compile(r'\(\?\)(?:\s*,\s*\(\?\))+')
+_WHITESPACE = re.compile(r'\s+')
+
+# EXPLAIN syntax per dialect, others are profiled without plans
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN '
+}
+
+def fingerprint(statement):
+    # Statements differing only in literals or in how many rows/IN values they carry count as one
+    statement = _STRING_LITERAL.sub('?', statement)
+    statement = _NUMBER_LITERAL.sub('?', statement)
+    statement = statement.replace('%s', '?')
+    statement = _PARAMETER_LIST.sub('(?)', statement)
+    statement = _ROW_LIST.sub('(?), ...', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+# SQLite reports "SCAN <table>" for a walk over every row, through an index or not ("SCAN t USING
+# COVERING INDEX ix" still reads all of ix), and "SEARCH" only when an index narrows it. Subqueries and
+# VALUES lists are scanned too but aren't tables. Postgres says "Seq Scan"
+_FULL_SCAN = re.compile(r'^(SCAN (?!\(|.*CONSTANT ROW)|Seq Scan)')
+
+def is_full_scan(plan):
+    return any(_FULL_SCAN.match(row.strip(' ->')) for row in plan)
+
+class QueryProfiler:
+    def __init__(self, slow_threshold=None, max_statements=None, slow_log_size=None):
+        self.slow_threshold = config.QUERY_PROFILER_SLOW_THRESHOLD if slow_threshold is None else slow_threshold
+        self.max_statements = max_statements or config.QUERY_PROFILER_MAX_STATEMENTS
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._plans = {}
+        self._slow = deque(maxlen=slow_log_size or config.QUERY_PROFILER_SLOW_LOG_SIZE)
+        self._dropped = 0
+        self.explain_prefix = None
+
+    def attach(self, engine):
+        from sqlalchemy import event
+        self.explain_prefix = EXPLAIN_PREFIXES.get(engine.dialect.name)
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profile_start', []).append(time.perf_counter())
+
+    def _handle_error(self, exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('profile_start'):
+            connection.info['profile_start'].pop()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['profile_start'].pop()
+        # rowcount is rows written, or rows returned where the driver knows it (SQLite doesn't for SELECT)
+        rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else 0
+        handler_name, method = current_operation.get()
+        key = (fingerprint(statement), handler_name, method)
+
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                if len(self._statements) >= self.max_statements:
+                    self._dropped += 1
+                    return
+                entry = self._statements[key] = {
+                    'fingerprint': key[0],
+                    'handler': handler_name,
+                    'method': method,
+                    'calls': 0,
+                    'total_time': 0.0,
+                    'max_time': 0.0,
+                    'rows': 0
+                }
+            entry['calls'] += 1
+            entry['total_time'] += elapsed
+            entry['max_time'] = max(entry['max_time'], elapsed)
+            entry['rows'] += rows
+
+        if elapsed >= self.slow_threshold:
+            self._record_slow(cursor, key, statement, parameters, executemany, elapsed)
+
+    def _record_slow(self, cursor, key, statement, parameters, executemany, elapsed):
+        plan = self._explain(cursor, key[0], statement, parameters, executemany)
+        with self._lock:
+            self._slow.append({
+                'fingerprint': key[0],
+                'handler': key[1],
+                'method': key[2],
+                'statement': statement[:2000],
+                'time': elapsed,
+                'at': time.time(),
+                'plan': plan,
+                'full_scan': is_full_scan(plan) if plan else None
+            })
+
+    def _explain(self, cursor, statement_fingerprint, statement, parameters, executemany):
+        # One plan per fingerprint is enough, they don't change between calls
+        if statement_fingerprint in self._plans:
+            return self._plans[statement_fingerprint]
+        if self.explain_prefix is None or executemany or statement.lstrip().upper().startswith(('PRAGMA', 'EXPLAIN')):
+            return None
+
+        # A second cursor on the same DBAPI connection, so the plan sees the same transaction
+        # and the engine's own events don't fire for it
+        explain_cursor = cursor.connection.cursor()
+        try:
+            explain_cursor.execute(self.explain_prefix + statement, parameters)
+            plan = [str(row[-1]) for row in explain_cursor.fetchall()]
+        except Exception as e:
+            plan = [f"EXPLAIN failed: {e}"]
+        finally:
+            explain_cursor.close()
+        self._plans[statement_fingerprint] = plan
+        return plan
+
+    def report(self):
+        with self._lock:
+            statements = sorted((dict(entry) for entry in self._statements.values()), key=lambda entry: -entry['total_time'])
+            slow = list(self._slow)
+            dropped = self._dropped
+        for entry in statements:
+            entry['mean_time'] = entry['total_time'] / entry['calls']
+            plan = self._plans.get(entry['fingerprint'])
+            entry['plan'] = plan
+            entry['full_scan'] = is_full_scan(plan) if plan else None
+        return {
+            'slow_threshold': self.slow_threshold,
+            'statements': statements,
+            'slow': slow,
+            'dropped_statements': dropped
+        }
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._slow.clear()
+            self._plans.clear()
+            self._dropped = 0
+
+query_profiler = QueryProfiler() if config.QUERY_PROFILER_ENABLED else None
@@ -0,0 +1,88 @@
+# Largest value an Integer column holds on every supported database
+MAX_INTEGER = 2 ** 31 - 1
+
+_MISSING = object()
+
+class Field:
+    def __init__(self, kind, default=_MISSING, min_length=0, max_length=None, minimum=None, maximum=None):
+        if kind not in (int, str):
+            raise ValueError(f"Unsupported field type: {kind}")
+        self.kind = kind
+        self.default = default
+        self.min_length = min_length
+        self.max_length = max_length
+        self.minimum = minimum
+        self.maximum = MAX_INTEGER if maximum is None and kind is int else maximum
+
+    @property
+    def required(self):
+        return self.default is _MISSING
+
+    def compile(self, name):
+        # One closure per field that returns the coerced value or raises ValueError,
+        # so the checks that apply are decided here and not on every payload
+        if self.kind is int:
+            minimum, maximum = self.minimum, self.maximum
+
+            def coerce(value):
+                # bool is an int subclass, but true is not a player count
+                if type(value) is int:
+                    pass
+                elif type(value) is float and value.is_integer():
+                    value = int(value)
+                elif type(value) is str:
+                    try:
+                        value = int(value)
+                    except ValueError:
+                        raise ValueError(f"{name} must be an integer") from None
+                else:
+                    raise ValueError(f"{name} must be an integer")
+                if minimum is not None and value < minimum:
+                    raise ValueError(f"{name} must be at least {minimum}")
+                if maximum is not None and value > maximum:
+                    raise ValueError(f"{name} must be at most {maximum}")
+                return value
+        else:
+            min_length, max_length = self.min_length, self.max_length
+
+            def coerce(value):
+                if type(value) is not str:
+                    # An integer reads back the way it was sent, a float doesn't (1.10 parses as 1.1)
+                    if type(value) is int:
+                        value = str(value)
+                    else:
+                        raise ValueError(f"{name} must be a string")
+                if len(value) < min_length:
+                    raise ValueError(f"{name} must be at least {min_length} characters")
+                if max_length is not None and len(value) > max_length:
+                    raise ValueError(f"{name} must be at most {max_length} characters")
+                return value
+        return coerce
+
+# Compiles {name: Field} into one function taking a decoded payload and returning (record, error).
+# The record holds exactly the schema's fields, defaults filled in and values coerced; unknown keys are dropped
+def compile_schema(fields):
+    steps = tuple((name, field.compile(name), field.required, field.default) for name, field in fields.items())
+
+    def validate(data):
+        if type(data) is not dict:
+            return None, 'Expected a JSON object'
+        record = {}
+        missing = []
+        for name, coerce, required, default in steps:
+            value = data.get(name, _MISSING)
+            if value is _MISSING or value is None:
+                if required:
+                    missing.append(name)
+                    continue
+                record[name] = default
+                continue
+            try:
+                record[name] = coerce(value)
+            except ValueError as e:
+                return None, str(e)
+        if missing:
+            return None, f"Missing fields: {', '.join(missing)}"
+        return record, None
+
+    return validate
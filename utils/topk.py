@@ -0,0 +1,16 @@
+import heapq
+
+OTHER_LABEL = 'Other'
+
+def top_with_other(items, limit, other_label=OTHER_LABEL):
+    # items are (label, count) pairs. Keeps the `limit` most common labels, ties going to the lower label
+    # so every process picks the same ones, in label order followed by one bucket holding the rest.
+    # A label that is itself other_label always goes into that bucket, so it is never listed twice.
+    # A limit of 0 keeps every label
+    items = list(items)
+    if not limit or len(items) <= limit:
+        return sorted(items)
+    ranked = [item for item in items if item[0] != other_label]
+    top = heapq.nsmallest(limit, ranked, key=lambda item: (-item[1], item[0]))
+    other = sum(count for _, count in items) - sum(count for _, count in top)
+    return sorted(top) + [(other_label, other)]
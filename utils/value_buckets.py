@@ -0,0 +1,42 @@
+import math
+
+class ValueBuckets:
+    # Maps non-negative integers to histogram buckets, the scheme DDSketch uses: small values get a bucket
+    # each, larger ones share buckets growing geometrically so a bucket's value is within about
+    # relative_accuracy of everything in it (rounding to an integer adds a little).
+    # Histograms keyed this way add and subtract bucket by bucket
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        # Up to here a bucket would hold one or two integers anyway, rounding its middle would be most of the error
+        self.exact_limit = math.ceil(1 / relative_accuracy)
+        self._offset = self.exact_limit - math.ceil(math.log(self.exact_limit) / self._log_gamma)
+
+    def key(self, value):
+        if value <= self.exact_limit:
+            return value
+        return math.ceil(math.log(value) / self._log_gamma) + self._offset
+
+    def value(self, key):
+        if key <= self.exact_limit:
+            return key
+        # Middle of the bucket (gamma ** (i - 1), gamma ** i], rounded since the values are integers
+        return round(2 * self.gamma ** (key - self._offset) / (self.gamma + 1))
+
+def weighted_quantiles(items, fractions):
+    # items are (value, count) pairs sorted by value. The smallest value covering each fraction of the total
+    total = sum(count for _, count in items)
+    if not total:
+        return [None for _ in fractions]
+    results = []
+    for fraction in fractions:
+        target = fraction * total
+        cumulative = 0
+        for value, count in items:
+            cumulative += count
+            if cumulative >= target:
+                results.append(value)
+                break
+        else:
+            results.append(items[-1][0])
+    return results
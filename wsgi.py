@@ -0,0 +1,9 @@
+# WSGI target for waitress-serve or a single-process server, e.g.
+#   waitress-serve --port=46423 --threads=8 wsgi:app
+# gunicorn should call the factory instead, so every worker builds its own app:
+#   gunicorn --workers 4 --threads 8 'main:create_app()'
+# Neither knows how many processes serve the database, so live aggregates stay off
+# unless LIVE_AGGREGATES_ENABLED=True is set for a single process (gunicorn never uses them)
+from main import create_app
+
+app = create_app()